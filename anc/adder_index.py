@@ -0,0 +1,192 @@
+"""A precomputed table answering "which adder, and which block size, minimizes volume for this addition?".
+
+Usage:
+    python adder_index.py build INDEX.npz [--dataset DIR] [--max-n 20000] [--g 1.5]
+
+    from adder_index import AdderIndex
+    index = AdderIndex.load('INDEX.npz')
+    choice = index.lookup(n=3000, factory_count=50, in_place=True)
+
+Building evaluates every adder over a geometric (register size, factory count, distance scale) grid. Lookups
+binary-search the grid axes and interpolate log-volumes between the surrounding grid points, so they cost
+microseconds. Loading only reads one small `.npz` file and does not import the cost model or plotting code.
+Queries outside the grid raise a `ValueError` instead of extrapolating. The returned block size is `None` for
+adders whose cost doesn't depend on it.
+"""
+
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import argparse
+import pathlib
+
+import numpy as np
+
+
+class AdderChoice(NamedTuple):
+    adder: str
+    b: Optional[int]
+    volume: float
+
+
+def _bracket(axis: np.ndarray, x: float, name: str, values: np.ndarray) -> Tuple[int, int, float]:
+    """Returns the indices of the axis entries around x, and how far x is from the first towards the second."""
+    if not axis[0] <= x <= axis[-1]:
+        raise ValueError(f"{name} is outside the indexed range [{values[0]}, {values[-1]}].")
+    if x == axis[0] or len(axis) == 1:
+        return 0, 0, 0.0
+    if x == axis[-1]:
+        k = len(axis) - 1
+        return k, k, 0.0
+    i1 = int(np.searchsorted(axis, x, side='right'))
+    i0 = i1 - 1
+    return i0, i1, float((x - axis[i0]) / (axis[i1] - axis[i0]))
+
+
+class AdderIndex:
+    def __init__(self,
+                 *,
+                 adders: Sequence[str],
+                 in_place: np.ndarray,
+                 b_sensitive: np.ndarray,
+                 register_sizes: np.ndarray,
+                 factory_counts: np.ndarray,
+                 distances: np.ndarray,
+                 log_volumes: np.ndarray,
+                 best_b: np.ndarray):
+        self.adders = list(adders)
+        self.in_place = np.asarray(in_place, dtype=bool)
+        self.b_sensitive = np.asarray(b_sensitive, dtype=bool)
+        self.register_sizes = np.asarray(register_sizes)
+        self.factory_counts = np.asarray(factory_counts)
+        self.distances = np.asarray(distances)
+        self.log_volumes = log_volumes
+        self.best_b = best_b
+        self._log_n = np.log(self.register_sizes)
+        self._log_f = np.log(self.factory_counts)
+
+    @staticmethod
+    def load(path: pathlib.Path) -> 'AdderIndex':
+        with np.load(path) as data:
+            return AdderIndex(adders=[str(e) for e in data['adders']],
+                              in_place=data['in_place'],
+                              b_sensitive=data['b_sensitive'],
+                              register_sizes=data['register_sizes'],
+                              factory_counts=data['factory_counts'],
+                              distances=data['distances'],
+                              log_volumes=data['log_volumes'],
+                              best_b=data['best_b'])
+
+    def save(self, path: pathlib.Path):
+        np.savez(path,
+                 adders=np.array(self.adders),
+                 in_place=self.in_place,
+                 b_sensitive=self.b_sensitive,
+                 register_sizes=self.register_sizes,
+                 factory_counts=self.factory_counts,
+                 distances=self.distances,
+                 log_volumes=self.log_volumes,
+                 best_b=self.best_b)
+
+    def lookup(self,
+               n: int,
+               factory_count: int,
+               d: float = 1.0,
+               in_place: Optional[bool] = None) -> AdderChoice:
+        """Returns the adder with the least interpolated volume, with its interpolated best block size.
+
+        Raises a `ValueError` if the query is outside the grid the index was built over.
+
+        Args:
+            n: The register size of the addition.
+            factory_count: The number of available factories.
+            d: The code distance used by the factories, relative to the distance used by the adder.
+            in_place: If set, only adders that are (or are not) in-place are considered.
+        """
+        corners = []
+        n_bracket = _bracket(self._log_n, np.log(n), f'n={n}', self.register_sizes)
+        f_bracket = _bracket(self._log_f, np.log(factory_count), f'factory_count={factory_count}', self.factory_counts)
+        d_bracket = _bracket(self.distances, d, f'd={d}', self.distances)
+        for i, ti in _corners(n_bracket):
+            for j, tj in _corners(f_bracket):
+                for k, tk in _corners(d_bracket):
+                    corners.append((i, j, k, ti * tj * tk))
+        log_volumes = sum(w * self.log_volumes[:, i, j, k] for i, j, k, w in corners)
+        if in_place is not None:
+            log_volumes = np.where(self.in_place == in_place, log_volumes, np.inf)
+        a = int(np.argmin(log_volumes))
+        b = None
+        if self.b_sensitive[a]:
+            log_b = sum(w * np.log(self.best_b[a, i, j, k]) for i, j, k, w in corners)
+            b = int(round(float(np.exp(log_b))))
+        return AdderChoice(adder=self.adders[a], b=b, volume=float(np.exp(log_volumes[a])))
+
+
+def _corners(bracket: Tuple[int, int, float]) -> List[Tuple[int, float]]:
+    i0, i1, t = bracket
+    if i0 == i1:
+        return [(i0, 1.0)]
+    return [(i0, 1 - t), (i1, t)]
+
+
+def build_index(dataset_dir: pathlib.Path,
+                *,
+                max_n: int = 20000,
+                g: float = 1.5,
+                distances: Sequence[float] = (0.5, 1.0)) -> AdderIndex:
+    """Evaluates every adder over the grid (reusing volumes already stored in the dataset) and indexes them."""
+    from dataset import VolumeDataset
+    from generate_figures import make_adders, phase_diagram_grid
+
+    adders = make_adders()
+    if (dataset_dir / 'metadata.json').exists():
+        dataset = VolumeDataset.open(dataset_dir, mode='r+')
+    else:
+        register_sizes, factory_counts = phase_diagram_grid(max_n=max_n, g=g)
+        dataset = VolumeDataset.create(dataset_dir,
+                                       adders=adders,
+                                       register_sizes=register_sizes,
+                                       factory_counts=factory_counts,
+                                       distances=distances)
+    meta = dataset.metadata
+    missing = set(meta['adders']) - set(adder.label for adder in adders)
+    if missing:
+        raise ValueError(f"The dataset contains adders that no longer exist: {sorted(missing)}")
+    by_label = {adder.label: adder for adder in adders}
+    ordered = [by_label[label] for label in meta['adders']]
+    for adder in ordered:
+        for n in meta['register_sizes']:
+            for f in meta['factory_counts']:
+                for d in meta['distances']:
+                    dataset.fill_vol(adder, n, f, d)
+    dataset.flush()
+    return AdderIndex(adders=meta['adders'],
+                      in_place=np.array([adder.in_place for adder in ordered]),
+                      b_sensitive=np.array([adder.is_b_sensitive() for adder in ordered]),
+                      register_sizes=np.array(meta['register_sizes']),
+                      factory_counts=np.array(meta['factory_counts']),
+                      distances=np.array(meta['distances']),
+                      log_volumes=np.log(np.asarray(dataset.volumes)).astype(np.float32),
+                      best_b=np.asarray(dataset.best_b).astype(np.int32))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build')
+    build_parser.add_argument('index', type=pathlib.Path)
+    build_parser.add_argument('--dataset', type=pathlib.Path, default=None)
+    build_parser.add_argument('--max-n', type=int, default=20000)
+    build_parser.add_argument('--g', type=float, default=1.5)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        dataset_dir = args.dataset
+        if dataset_dir is None:
+            dataset_dir = args.index.parent / (args.index.stem + '-dataset')
+        index = build_index(dataset_dir, max_n=args.max_n, g=args.g)
+        index.save(args.index)
+        print(f"Generated file://{args.index.absolute()}")
+
+
+if __name__ == '__main__':
+    main()
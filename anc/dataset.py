@@ -0,0 +1,332 @@
+"""Stores every computed adder volume so that figures and tables can be re-rendered without recomputing them.
+
+Usage:
+    python dataset.py build DIR     (computes everything the figures need, then renders them)
+    python dataset.py render DIR [--out-dir ../gen]     (renders from the stored volumes only)
+
+`generate_figures.py` builds the same dataset in `gen/dataset`. Building prunes the phase diagrams like
+`generate_figures.best_adder_index` does, so the volumes of adders that can't win a cell stay NaN there.
+
+A dataset is a directory holding `metadata.json` plus three memory-mapped `.npy` arrays indexed by
+(adder, register size, factory count, distance scale): `volumes.npy` (NaN where not computed), `best_b.npy`
+(the block size achieving each volume, -1 where not computed) and `win_probability.npy` (the fraction of cost
+samples in which the adder beats the other adders of its phase diagram, NaN where not computed). The metadata
+also records the number of cost samples and their seed, and the (register size, factory count) grid of the phase
+diagrams. Rendering skips, and reports, any figure whose points the dataset doesn't have (e.g. a dataset merged by
+`sweep.py` only has the phase diagrams). Opening a dataset only maps the files, so slicing a large
+tensor only reads the touched pages.
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import argparse
+import json
+import math
+import pathlib
+
+import numpy as np
+
+from generate_figures import (
+    Adder,
+    CostSamples,
+    TABLE_PARAMS,
+    VolumeFn,
+    make_adders,
+    make_table,
+    phase_diagram_grid,
+    phase_diagram_sweeps,
+    plot_phase_diagram,
+    plot_phase_diagram_helper,
+    plot_volume_vs_size,
+    plot_win_probability,
+    volume_vs_size_points,
+    win_probabilities,
+)
+
+
+METADATA_NAME = 'metadata.json'
+VOLUMES_NAME = 'volumes.npy'
+BEST_B_NAME = 'best_b.npy'
+WIN_PROBABILITY_NAME = 'win_probability.npy'
+
+
+class VolumeDataset:
+    def __init__(self,
+                 directory: pathlib.Path,
+                 metadata: Dict[str, Any],
+                 volumes: np.ndarray,
+                 best_b: np.ndarray,
+                 win_probability: np.ndarray):
+        self.directory = directory
+        self.metadata = metadata
+        self.volumes = volumes
+        self.best_b = best_b
+        self.win_probability = win_probability
+        self._adder_index = {label: k for k, label in enumerate(metadata['adders'])}
+        self._n_index = {n: k for k, n in enumerate(metadata['register_sizes'])}
+        self._f_index = {f: k for k, f in enumerate(metadata['factory_counts'])}
+        self._d_index = {d: k for k, d in enumerate(metadata['distances'])}
+
+    @staticmethod
+    def create(directory: pathlib.Path,
+               *,
+               adders: List[Adder],
+               register_sizes: Sequence[int],
+               factory_counts: Sequence[int],
+               distances: Sequence[float],
+               sample_count: int = 2000,
+               sample_seed: int = 0,
+               phase_diagram_register_sizes: Optional[Sequence[int]] = None,
+               phase_diagram_factory_counts: Optional[Sequence[int]] = None) -> 'VolumeDataset':
+        """Creates an empty dataset. The phase diagram grid defaults to every register size and factory count."""
+        if phase_diagram_register_sizes is None:
+            phase_diagram_register_sizes = register_sizes
+        if phase_diagram_factory_counts is None:
+            phase_diagram_factory_counts = factory_counts
+        metadata = {
+            'adders': [adder.label for adder in adders],
+            'register_sizes': sorted(set(int(n) for n in register_sizes)),
+            'factory_counts': sorted(set(int(f) for f in factory_counts)),
+            'distances': sorted(set(float(d) for d in distances)),
+            'factory_area': 12 * 6,
+            'factory_period': 165,
+            'reaction_time': 10,
+            'sample_count': sample_count,
+            'sample_seed': sample_seed,
+            'phase_diagram_register_sizes': sorted(set(int(n) for n in phase_diagram_register_sizes)),
+            'phase_diagram_factory_counts': sorted(set(int(f) for f in phase_diagram_factory_counts)),
+        }
+        shape = (len(metadata['adders']),
+                 len(metadata['register_sizes']),
+                 len(metadata['factory_counts']),
+                 len(metadata['distances']))
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / METADATA_NAME, 'w') as f:
+            json.dump(metadata, f, indent=1)
+        volumes = np.lib.format.open_memmap(directory / VOLUMES_NAME, mode='w+', dtype=np.float64, shape=shape)
+        volumes[...] = np.nan
+        best_b = np.lib.format.open_memmap(directory / BEST_B_NAME, mode='w+', dtype=np.int32, shape=shape)
+        best_b[...] = -1
+        win_probability = np.lib.format.open_memmap(
+            directory / WIN_PROBABILITY_NAME, mode='w+', dtype=np.float64, shape=shape)
+        win_probability[...] = np.nan
+        return VolumeDataset(directory, metadata, volumes, best_b, win_probability)
+
+    @staticmethod
+    def open(directory: pathlib.Path, mode: str = 'r') -> 'VolumeDataset':
+        with open(directory / METADATA_NAME) as f:
+            metadata = json.load(f)
+        return VolumeDataset(directory,
+                             metadata,
+                             np.load(directory / VOLUMES_NAME, mmap_mode=mode),
+                             np.load(directory / BEST_B_NAME, mmap_mode=mode),
+                             np.load(directory / WIN_PROBABILITY_NAME, mmap_mode=mode))
+
+    def cell(self, adder: Adder, n: int, factory_count: int, d: float) -> Tuple[int, int, int, int]:
+        try:
+            return (self._adder_index[adder.label],
+                    self._n_index[n],
+                    self._f_index[factory_count],
+                    self._d_index[d])
+        except KeyError as ex:
+            raise KeyError(f"({adder.label}, n={n}, f={factory_count}, d={d}) is outside the dataset.") from ex
+
+    def vol(self, adder: Adder, n: int, factory_count: int, d: float = 1.0) -> float:
+        """Looks up a stored volume. Matches `generate_figures.VolumeFn`."""
+        result = float(self.volumes[self.cell(adder, n, factory_count, d)])
+        if math.isnan(result):
+            raise ValueError(f"({adder.label}, n={n}, f={factory_count}, d={d}) was not computed.")
+        return result
+
+    def fill_vol(self, adder: Adder, n: int, factory_count: int, d: float = 1.0) -> float:
+        """Looks up a stored volume, computing and storing it first if it is missing."""
+        cell = self.cell(adder, n, factory_count, d)
+        if math.isnan(self.volumes[cell]):
+            self.volumes[cell], self.best_b[cell] = adder.vol_and_b(
+                n=n,
+                factory_count=factory_count,
+                factory_area=self.metadata['factory_area'] * d**2,
+                factory_period=self.metadata['factory_period'] * d,
+                reaction_time=self.metadata['reaction_time'])
+        return float(self.volumes[cell])
+
+    def vol_lower_bound(self, adder: Adder, n: int, d: float = 1.0) -> float:
+        """A lower bound on `fill_vol`, for any factory count. Matches `generate_figures.VolumeBoundFn`."""
+        return adder.vol_lower_bound(n=n,
+                                     factory_area=self.metadata['factory_area'] * d**2,
+                                     factory_period=self.metadata['factory_period'] * d,
+                                     reaction_time=self.metadata['reaction_time'])
+
+    def winners(self,
+                adder_set: List[Adder],
+                register_sizes: Sequence[int],
+                factory_counts: Sequence[int],
+                d: float) -> np.ndarray:
+        """Returns the index of the min-volume adder for each (factory count, register size) cell.
+
+        Adders that weren't computed in a cell (because pruning showed that they can't win it) are ignored.
+        """
+        a = [self._adder_index[adder.label] for adder in adder_set]
+        i = [self._n_index[n] for n in register_sizes]
+        j = [self._f_index[f] for f in factory_counts]
+        volumes = np.asarray(self.volumes[np.ix_(a, i, j, [self._d_index[d]])])[..., 0]
+        empty = np.all(np.isnan(volumes), axis=0)
+        if np.any(empty):
+            i, j = np.argwhere(empty)[0]
+            raise ValueError(f"No volume was computed at (n={register_sizes[i]}, f={factory_counts[j]}, d={d}).")
+        return np.nanargmin(volumes, axis=0).T.astype(np.int32)
+
+    def missing_point(self,
+                      adders: List[Adder],
+                      points: List[Tuple[int, int]],
+                      distances: Sequence[float],
+                      stored: Optional[np.ndarray] = None) -> Optional[str]:
+        """Describes an (adder, n, f, d) point outside the dataset (or NaN in `stored`), or returns None."""
+        for d in distances:
+            for n, f in points:
+                for adder in adders:
+                    try:
+                        cell = self.cell(adder, n, f, d)
+                    except KeyError as ex:
+                        return ex.args[0]
+                    if stored is not None and math.isnan(stored[cell]):
+                        return f"({adder.label}, n={n}, f={f}, d={d}) was not computed."
+        return None
+
+    def samples(self) -> CostSamples:
+        """The cost samples that the stored win probabilities were computed from."""
+        return CostSamples.sample(self.metadata['sample_count'], seed=self.metadata['sample_seed'])
+
+    def win_probabilities(self, adder_set: List[Adder], n: int, factory_count: int, d: float = 1.0) -> np.ndarray:
+        """Looks up stored win probabilities. Matches `generate_figures.WinProbabilityFn`."""
+        result = np.array([self.win_probability[self.cell(adder, n, factory_count, d)] for adder in adder_set])
+        if np.any(np.isnan(result)):
+            raise ValueError(f"Win probabilities at (n={n}, f={factory_count}, d={d}) were not computed.")
+        return result
+
+    def fill_win_probabilities(self,
+                               adder_set: List[Adder],
+                               n: int,
+                               factory_count: int,
+                               d: float = 1.0,
+                               samples: Optional[CostSamples] = None) -> np.ndarray:
+        """Looks up stored win probabilities, computing and storing them first if any are missing."""
+        cells = [self.cell(adder, n, factory_count, d) for adder in adder_set]
+        if any(math.isnan(self.win_probability[cell]) for cell in cells):
+            if samples is None:
+                samples = self.samples()
+            probabilities = win_probabilities(adder_set, n=n, factory_count=factory_count, samples=samples, d=d)
+            for cell, p in zip(cells, probabilities):
+                self.win_probability[cell] = p
+        return np.array([self.win_probability[cell] for cell in cells])
+
+    def flush(self):
+        self.volumes.flush()
+        self.best_b.flush()
+        self.win_probability.flush()
+
+
+def create_figure_dataset(directory: pathlib.Path, adders: List[Adder]) -> VolumeDataset:
+    """Creates an empty dataset whose axes cover every point used by the table and figures."""
+    register_sizes, factory_counts = phase_diagram_grid()
+    points = volume_vs_size_points() + TABLE_PARAMS
+    return VolumeDataset.create(
+        directory,
+        adders=adders,
+        register_sizes=register_sizes + [n for n, _ in points],
+        factory_counts=factory_counts + [f for _, f in points],
+        distances=[d for _, _, _, d in phase_diagram_sweeps(adders)],
+        phase_diagram_register_sizes=register_sizes,
+        phase_diagram_factory_counts=factory_counts)
+
+
+def render(adders: List[Adder],
+           dataset: VolumeDataset,
+           out_dir: pathlib.Path,
+           compute: bool = False):
+    """Renders the table and figures from the dataset.
+
+    If `compute` is set, values missing from the dataset are computed and stored. Otherwise figures needing values
+    that weren't computed are skipped. Figures needing points outside the dataset are always skipped.
+    """
+    samples = dataset.samples()
+    vol: VolumeFn = dataset.vol
+    win_probability = dataset.win_probabilities
+    volumes = None if compute else dataset.volumes
+    win_probability_values = None if compute else dataset.win_probability
+    if compute:
+        vol = dataset.fill_vol
+        win_probability = lambda adder_set, n, f, d: dataset.fill_win_probabilities(adder_set, n, f, d, samples)
+    register_sizes = dataset.metadata['phase_diagram_register_sizes']
+    factory_counts = dataset.metadata['phase_diagram_factory_counts']
+    grid = [(n, f) for n in register_sizes for f in factory_counts]
+    sweeps = phase_diagram_sweeps(adders)
+    sweep_adders = [adder for adder_set, _, _, _ in sweeps for adder in adder_set]
+    sweep_distances = [d for _, _, _, d in sweeps]
+
+    def skip(name: str, problem: Optional[str]) -> bool:
+        if problem is not None:
+            print(f"Skipped {name}: {problem}")
+        return problem is not None
+
+    if not skip('the comparison table', dataset.missing_point(adders, TABLE_PARAMS, [1.0], volumes)):
+        comp_path = out_dir / 'comparison_table.tex'
+        with open(comp_path, 'w') as f:
+            print(make_table(adders, vol=vol), file=f)
+        print(f"Generated file://{comp_path}")
+    if not skip('the volume vs size plots', dataset.missing_point(adders, volume_vs_size_points(), [1.0], volumes)):
+        plot_volume_vs_size(adders, out_dir, vol=vol)
+    if compute:
+        if not skip('the phase diagrams', dataset.missing_point(sweep_adders, grid, sweep_distances)):
+            plot_phase_diagram(adders,
+                               out_dir,
+                               vol=vol,
+                               lower_bound=dataset.vol_lower_bound,
+                               register_sizes=register_sizes,
+                               factory_counts=factory_counts)
+    else:
+        for adder_set, title, file_name, d in sweeps:
+            problem = dataset.missing_point(adder_set, grid, [d])
+            if problem is None:
+                try:
+                    data = dataset.winners(adder_set, register_sizes, factory_counts, d)
+                except ValueError as ex:
+                    problem = ex.args[0]
+            if not skip(file_name, problem):
+                plot_phase_diagram_helper(adder_set,
+                                          title,
+                                          filepath=out_dir / file_name,
+                                          d=d,
+                                          factory_counts=factory_counts,
+                                          register_sizes=register_sizes,
+                                          data=data)
+    if not skip('the win probability maps',
+                dataset.missing_point(sweep_adders, grid, sweep_distances, win_probability_values)):
+        plot_win_probability(adders,
+                             out_dir,
+                             samples,
+                             win_probability=win_probability,
+                             register_sizes=register_sizes,
+                             factory_counts=factory_counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    for command in ['build', 'render']:
+        sub = commands.add_parser(command)
+        sub.add_argument('directory', type=pathlib.Path)
+        sub.add_argument('--out-dir', type=pathlib.Path, default=pathlib.Path(__file__).parent.parent / 'gen')
+    args = parser.parse_args()
+
+    adders = make_adders()
+    if args.command == 'build':
+        dataset = create_figure_dataset(args.directory, adders)
+        render(adders, dataset, args.out_dir, compute=True)
+        dataset.flush()
+    elif args.command == 'render':
+        render(adders, VolumeDataset.open(args.directory), args.out_dir)
+
+
+if __name__ == '__main__':
+    main()
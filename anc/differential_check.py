@@ -0,0 +1,265 @@
+"""Checks that a cost model engine agrees with the frozen reference engine on random inputs, and times both.
+
+Usage:
+    python differential_check.py [--engine generate_figures] [--cases 50] [--seed 0] [--rtol 1e-9] [--verbose]
+
+The engine is any module providing `SimpleFormula`, `Tot`, `fold_down`, `hold` and `Adder` with the same
+constructors as `reference_cost_model`. Random formulas, random `Tot` compositions and random adders are built
+identically in both engines, then `SimpleFormula.value`, `Tot.heights`, `Tot.simulate_supply` and `Adder.vol` are
+compared. Each side is timed once, on freshly built objects with module level caches cleared, so the reported
+speedups are for cold queries. Exits with a non-zero status if any case disagrees.
+"""
+
+from typing import Any, Callable, Dict, List, Tuple
+
+import argparse
+import dataclasses
+import importlib
+import math
+import sys
+import time
+import types
+
+import numpy as np
+
+import reference_cost_model
+
+
+FORMULA_TERMS = ['n2', 'n', 'sqrt_n', 'lg_n', 'constant', 'b', 'n_over_b', 'lg_n_over_b']
+
+
+@dataclasses.dataclass
+class CaseResult:
+    kind: str
+    description: str
+    max_error: float
+    reference_seconds: float
+    engine_seconds: float
+
+    @property
+    def speedup(self) -> float:
+        return self.reference_seconds / max(self.engine_seconds, 1e-12)
+
+
+def random_formula_args(rng: np.random.Generator,
+                        *,
+                        max_terms: int = 3,
+                        scale: int = 4,
+                        quadratic: bool = True) -> Dict[str, Any]:
+    """Returns keyword arguments for a `SimpleFormula` with a few small non-negative integer coefficients."""
+    allowed = FORMULA_TERMS if quadratic else [term for term in FORMULA_TERMS if term != 'n2']
+    terms = rng.choice(allowed, size=rng.integers(1, min(max_terms, len(allowed)) + 1), replace=False)
+    args: Dict[str, Any] = {str(term): int(rng.integers(1, scale + 1)) for term in terms}
+    if 'n2' in args:
+        args['n2'] = 1
+    args['O_1'] = bool(rng.integers(2))
+    return args
+
+
+def random_tot_recipe(rng: np.random.Generator, depth: int = 3) -> Tuple:
+    """Returns a nested description of a random `Tot`, so the same composition can be built in each engine."""
+    if depth == 0 or rng.random() < 0.3:
+        if rng.random() < 0.5:
+            return ('fold_down', dict(
+                scale=int(rng.integers(0, 3)),
+                skip_start=int(rng.integers(0, 3)),
+                skip_end=int(rng.integers(0, 2)),
+                width=dict(random_formula_args(rng, max_terms=2, quadratic=False), O_1=False),
+                reps=int(rng.integers(1, 4)),
+                gap=int(rng.integers(0, 2)),
+            ))
+        # Quadratic durations or heights make profiles (or supply stalls) too long to check quickly.
+        duration = dict(random_formula_args(rng, max_terms=2, scale=2, quadratic=False), O_1=False)
+        duration['constant'] = duration.get('constant', 0) + 1
+        height = random_formula_args(rng, max_terms=2, quadratic=False)
+        return ('hold', dict(duration=duration, height=height))
+    op = str(rng.choice(['then', 'overlap', 'reversed']))
+    if op == 'reversed':
+        return ('reversed', random_tot_recipe(rng, depth - 1))
+    return (op,
+            random_tot_recipe(rng, depth - 1),
+            random_tot_recipe(rng, depth - 1),
+            int(rng.integers(0, 4)))
+
+
+def build_tot(engine: types.ModuleType, recipe: Tuple) -> Any:
+    kind = recipe[0]
+    if kind == 'fold_down':
+        args = dict(recipe[1])
+        args['width'] = engine.SimpleFormula(**args['width'])
+        return engine.fold_down(**args)
+    if kind == 'hold':
+        return engine.hold(duration=engine.SimpleFormula(**recipe[1]['duration']),
+                           height=engine.SimpleFormula(**recipe[1]['height']))
+    if kind == 'reversed':
+        return build_tot(engine, recipe[1]).reversed()
+    first = build_tot(engine, recipe[1])
+    second = build_tot(engine, recipe[2])
+    if kind == 'then':
+        return first.then(second, shift=recipe[3])
+    return first.overlap(second, shift=recipe[3])
+
+
+def _relative_error(expected: Any, actual: Any) -> float:
+    expected = np.asarray(expected, dtype=np.float64)
+    actual = np.asarray(actual, dtype=np.float64)
+    if expected.shape != actual.shape:
+        return math.inf
+    if expected.size == 0:
+        return 0.0
+    both_nan = np.isnan(expected) & np.isnan(actual)
+    error = np.abs(expected - actual) / np.maximum(np.abs(expected), 1e-300)
+    error = np.where(expected == actual, 0, error)
+    return float(np.max(np.where(both_nan, 0, error)))
+
+
+def _clear_caches(module: types.ModuleType):
+    for value in vars(module).values():
+        if hasattr(value, 'cache_clear'):
+            value.cache_clear()
+
+
+def _timed(module: types.ModuleType, func: Callable[[], Any]) -> Tuple[Any, float]:
+    _clear_caches(module)
+    t0 = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - t0
+
+
+def _compare(kind: str,
+             description: str,
+             reference: Callable[[], Any],
+             engine_module: types.ModuleType,
+             engine: Callable[[], Any]) -> CaseResult:
+    """Runs and times each side once.
+
+    Both callables must build their objects from scratch, and module level caches are cleared before each run, so
+    that an engine which caches results isn't timed on cache hits.
+    """
+    expected, reference_seconds = _timed(reference_cost_model, reference)
+    actual, engine_seconds = _timed(engine_module, engine)
+    return CaseResult(kind=kind,
+                      description=description,
+                      max_error=_relative_error(expected, actual),
+                      reference_seconds=reference_seconds,
+                      engine_seconds=engine_seconds)
+
+
+def check_formulas(engine: types.ModuleType, rng: np.random.Generator, cases: int) -> List[CaseResult]:
+    results = []
+    for _ in range(cases):
+        args = random_formula_args(rng, max_terms=len(FORMULA_TERMS), scale=20)
+        points = [(int(n), int(rng.integers(1, n + 1))) for n in rng.integers(1, 100000, size=200)]
+
+        def evaluate(module: types.ModuleType) -> List[float]:
+            formula = module.SimpleFormula(**args)
+            return [formula.value(n, b) for n, b in points]
+        results.append(_compare(
+            'SimpleFormula.value',
+            repr(args),
+            lambda: evaluate(reference_cost_model),
+            engine,
+            lambda: evaluate(engine)))
+    return results
+
+
+def check_tots(engine: types.ModuleType, rng: np.random.Generator, cases: int) -> List[CaseResult]:
+    results = []
+    for _ in range(cases):
+        recipe = random_tot_recipe(rng)
+        n = int(rng.integers(2, 1000))
+        b = int(rng.integers(2, n + 1))
+        rate = float(rng.uniform(0.5, 50))
+        results.append(_compare(
+            'Tot.heights',
+            f'n={n} b={b} {recipe}',
+            lambda: build_tot(reference_cost_model, recipe).heights(n, b),
+            engine,
+            lambda: build_tot(engine, recipe).heights(n, b)))
+        if len(build_tot(reference_cost_model, recipe).heights(n, b)):
+            results.append(_compare(
+                'Tot.simulate_supply',
+                f'n={n} b={b} rate={rate} {recipe}',
+                lambda: build_tot(reference_cost_model, recipe).simulate_supply(n, b, max_production_rate=rate),
+                engine,
+                lambda: build_tot(engine, recipe).simulate_supply(n, b, max_production_rate=rate)))
+    return results
+
+
+def check_adders(engine: types.ModuleType, rng: np.random.Generator, cases: int) -> List[CaseResult]:
+    results = []
+    for _ in range(cases):
+        formulas = {
+            'toffolis': random_formula_args(rng),
+            'reaction_depth': random_formula_args(rng),
+            'workspace': random_formula_args(rng),
+        }
+        recipe = random_tot_recipe(rng) if rng.random() < 0.7 else None
+        in_place = bool(rng.integers(2))
+
+        def make(module: types.ModuleType) -> Any:
+            return module.Adder(
+                author='random',
+                year=0,
+                citation=None,
+                type='random',
+                in_place=in_place,
+                toffoli_usage=None if recipe is None else build_tot(module, recipe),
+                **{key: module.SimpleFormula(**args) for key, args in formulas.items()})
+        ref = make(reference_cost_model)
+        params = dict(
+            n=int(rng.integers(2, 200)),
+            factory_count=int(rng.integers(8, 1000)),
+            factory_period=float(rng.uniform(100, 200)),
+            factory_area=float(rng.uniform(10, 200)),
+            reaction_time=float(rng.uniform(5, 15)),
+        )
+        if not all(len(ref.toffoli_usage_or_def(params['n'], b).heights(params['n'], b))
+                   for b in [2, params['n'], 10]):
+            continue
+        results.append(_compare(
+            'Adder.vol',
+            f'{params} {formulas} {recipe}',
+            lambda: make(reference_cost_model).vol(**params),
+            engine,
+            lambda: make(engine).vol(**params)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engine', default='generate_figures')
+    parser.add_argument('--cases', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rtol', type=float, default=1e-9)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    engine = importlib.import_module(args.engine)
+    rng = np.random.default_rng(args.seed)
+    results = (
+        check_formulas(engine, rng, args.cases)
+        + check_tots(engine, rng, args.cases)
+        + check_adders(engine, rng, args.cases)
+    )
+
+    failures = {id(result) for result in results if not result.max_error <= args.rtol}
+    for result in results:
+        if args.verbose or id(result) in failures:
+            status = 'FAIL' if id(result) in failures else 'ok'
+            print(f'{status:4} {result.kind:20} speedup={result.speedup:7.2f}x '
+                  f'error={result.max_error:.3g} {result.description}')
+    for kind in sorted(set(result.kind for result in results)):
+        group = [result for result in results if result.kind == kind]
+        speedups = np.array([result.speedup for result in group])
+        print(f'{kind:20} cases={len(group):4} '
+              f'failures={sum(id(result) in failures for result in group):4} '
+              f'max_error={max(result.max_error for result in group):.3g} '
+              f'speedup: geomean={np.exp(np.mean(np.log(speedups))):.2f}x '
+              f'min={np.min(speedups):.2f}x max={np.max(speedups):.2f}x')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
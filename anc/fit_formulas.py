@@ -0,0 +1,210 @@
+"""Fits `SimpleFormula` coefficients to measured costs, and flags hand-written formulas that disagree with them.
+
+Usage:
+    python fit_formulas.py COUNTS.csv [--metric NAME=COLUMN[/DIVISOR] ...] [--adder LABEL] [--tolerance 0.05]
+    python fit_formulas.py RUNS.csv --estimator-runs [--metric toffolis=T/7 ...] [--adder LABEL]
+
+COUNTS.csv has one row per measured (n, b) point, e.g. a tabulated gate-level trace, and may be comma or tab
+separated. It needs an `n` column, an optional `b` column (defaulting to `DEFAULT_B`), and one column per metric.
+By default the `toffolis`, `reaction_depth` and `workspace` columns are fitted; `--metric NAME=COLUMN` or
+`--metric NAME=COLUMN/DIVISOR` fits other columns (e.g. `toffolis=T/7`).
+
+Q#'s `ResourcesEstimator` writes one table per run, with a `Metric` row per counter (`CNOT`, `QubitClifford`, `R`,
+`Measure`, `T`, `Depth`, `Width`, ...) and its value in a `Sum` column. With `--estimator-runs`, RUNS.csv instead
+lists the runs: an `n` column, an optional `b` column and a `file` column naming the saved table of that run
+(relative to RUNS.csv). Metrics then name estimator counters. By default `Depth` (the T-depth, with the default
+estimator configuration) is fitted as `reaction_depth` and `Width` as `workspace`. Toffolis aren't counted
+directly, so add e.g. `--metric toffolis=T/7` (for the 7 T gate `CCNOT` decomposition) along with the others.
+
+If `--adder` names one of the adders in `generate_figures.make_adders` (by its `label`), each fitted metric is also
+compared against that adder's hand-written formula. An O(1) term in that formula is treated as an unknown constant.
+The exit status is non-zero if any formula deviates by more than the tolerance.
+"""
+
+from typing import Dict, List, Tuple
+
+import argparse
+import csv
+import pathlib
+import sys
+
+import numpy as np
+
+from generate_figures import DEFAULT_B, SimpleFormula, make_adders
+
+
+DEFAULT_METRICS = ('toffolis', 'reaction_depth', 'workspace')
+DEFAULT_ESTIMATOR_METRICS = {'reaction_depth': 'Depth', 'workspace': 'Width'}
+
+# Terms are added to a fit in this order, and skipped if they are indistinguishable from earlier ones at the
+# measured points (e.g. `b` when every point uses the same block size).
+FIT_ORDER = ('constant', 'n', 'n2', 'lg_n', 'sqrt_n', 'b', 'n_over_b', 'lg_n_over_b')
+
+# A term is indistinguishable if less than this fraction of it is left after removing its best fit by earlier terms.
+TERM_TOLERANCE = 1e-3
+
+
+def load_counts(path: pathlib.Path,
+                metrics: Dict[str, str]) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+    """Reads the n column, b column and metric columns of a counts file.
+
+    Args:
+        path: The CSV or TSV file to read.
+        metrics: Maps each metric name to a `COLUMN` or `COLUMN/DIVISOR` expression.
+    """
+    return _tabulate(_read_table(path), metrics)
+
+
+def load_estimator_runs(path: pathlib.Path,
+                        metrics: Dict[str, str]) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+    """Reads the `ResourcesEstimator` tables listed in a runs file, as if they had been tabulated by `load_counts`.
+
+    Args:
+        path: A CSV or TSV file with `n`, optional `b`, and `file` columns.
+        metrics: Maps each metric name to a `COUNTER` or `COUNTER/DIVISOR` expression.
+    """
+    rows = []
+    for run in _read_table(path):
+        estimates = {row['Metric'].strip(): row['Sum'] for row in _read_table(path.parent / run['file'])}
+        rows.append(dict(estimates, n=run['n'], b=run.get('b')))
+    return _tabulate(rows, metrics)
+
+
+def _read_table(path: pathlib.Path) -> List[Dict[str, str]]:
+    with open(path, newline='') as f:
+        dialect = csv.Sniffer().sniff(f.read(4096), delimiters=',\t')
+        f.seek(0)
+        return list(csv.DictReader(f, dialect=dialect, skipinitialspace=True))
+
+
+def _tabulate(rows: List[Dict[str, str]],
+              metrics: Dict[str, str]) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+    ns = np.array([int(row['n']) for row in rows], dtype=np.int64)
+    bs = np.array([int(row['b']) if row.get('b') else DEFAULT_B for row in rows], dtype=np.int64)
+    values = {}
+    for name, expression in metrics.items():
+        column, _, divisor = expression.partition('/')
+        values[name] = np.array([float(row[column]) for row in rows]) / float(divisor or 1)
+    return ns, bs, values
+
+
+def _smooth_basis(ns: np.ndarray, bs: np.ndarray) -> np.ndarray:
+    """Like `SimpleFormula.basis`, but without rounding up (or clamping `lg_n_over_b` at 0).
+
+    Rounding makes terms such as `lg_n_over_b` and `lg_n` look independent at a fixed block size, but no fit can
+    tell them apart by their rounding alone.
+    """
+    ns = np.asarray(ns, dtype=np.float64)
+    bs = np.asarray(bs, dtype=np.float64)
+    return np.stack([
+        ns * ns,
+        ns,
+        np.sqrt(ns),
+        np.log2(ns),
+        np.ones(len(ns)),
+        bs,
+        ns / bs,
+        np.log2(ns / bs),
+    ], axis=1)
+
+
+def _independent_terms(ns: np.ndarray, bs: np.ndarray) -> List[int]:
+    smooth = _smooth_basis(ns, bs)
+    kept: List[int] = []
+    for term in FIT_ORDER:
+        k = SimpleFormula.TERMS.index(term)
+        column = smooth[:, k]
+        residual = column
+        if kept:
+            solution, _, _, _ = np.linalg.lstsq(smooth[:, kept], column, rcond=None)
+            residual = column - smooth[:, kept] @ solution
+        if np.linalg.norm(residual) > TERM_TOLERANCE * np.linalg.norm(column):
+            kept.append(k)
+    return kept
+
+
+def _snap(coefficient: float) -> float:
+    snapped = round(coefficient * 4) / 4
+    if abs(coefficient - snapped) < 1e-2:
+        return int(snapped) if snapped == int(snapped) else snapped
+    return round(coefficient, 3)
+
+
+def fit_formulas(ns: np.ndarray, bs: np.ndarray, values: np.ndarray) -> List[SimpleFormula]:
+    """Least-squares fits one formula per column of `values` (a points x metrics matrix), all in one solve.
+
+    Terms that are (nearly) a combination of earlier terms in `FIT_ORDER` at the measured points are left out.
+    Coefficients within 0.01 of a multiple of 1/4 are snapped to it.
+    """
+    basis = SimpleFormula.basis(ns, bs)
+    scale = np.max(np.abs(basis), axis=0)
+    scale[scale == 0] = 1
+    design = basis / scale
+    kept = _independent_terms(ns, bs)
+    solution, _, _, _ = np.linalg.lstsq(design[:, kept], values.reshape(len(ns), -1), rcond=None)
+    solution /= scale[kept, np.newaxis]
+    formulas = []
+    for column in solution.T:
+        formulas.append(SimpleFormula(**{
+            SimpleFormula.TERMS[k]: _snap(c)
+            for k, c in zip(kept, column)
+            if _snap(c) != 0
+        }))
+    return formulas
+
+
+def deviation(formula: SimpleFormula, ns: np.ndarray, bs: np.ndarray, values: np.ndarray) -> float:
+    """The largest error of a formula relative to the measured values (or to 1 for values near zero).
+
+    An O(1) term is replaced by whichever constant fits the values best.
+    """
+    predicted = SimpleFormula.basis(ns, bs) @ np.array([getattr(formula, term) for term in SimpleFormula.TERMS])
+    if formula.O_1:
+        predicted += np.mean(values - predicted)
+    return float(np.max(np.abs(predicted - values) / np.maximum(np.abs(values), 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('counts', type=pathlib.Path)
+    parser.add_argument('--estimator-runs', action='store_true')
+    parser.add_argument('--metric', action='append', default=[])
+    parser.add_argument('--adder', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.05)
+    parsed = parser.parse_args()
+
+    metrics = {name: name for name in DEFAULT_METRICS}
+    if parsed.estimator_runs:
+        metrics = dict(DEFAULT_ESTIMATOR_METRICS)
+    if parsed.metric:
+        metrics = dict(metric.split('=', 1) for metric in parsed.metric)
+    adder = None
+    if parsed.adder is not None:
+        matches = [adder for adder in make_adders() if adder.label == parsed.adder]
+        if not matches:
+            raise ValueError(f"No adder is labelled {parsed.adder!r}.")
+        adder = matches[0]
+
+    load = load_estimator_runs if parsed.estimator_runs else load_counts
+    ns, bs, values = load(parsed.counts, metrics)
+    names = list(values)
+    fits = fit_formulas(ns, bs, np.stack([values[name] for name in names], axis=1))
+
+    flagged = False
+    for name, fit in zip(names, fits):
+        print(f"{name}: {fit.latex()} (max relative error {deviation(fit, ns, bs, values[name]):.3g})")
+        if adder is not None and hasattr(adder, name):
+            hand = getattr(adder, name)
+            error = deviation(hand, ns, bs, values[name])
+            status = 'ok'
+            if error > parsed.tolerance:
+                status = 'DEVIATES'
+                flagged = True
+            print(f"    {status}: hand-written {hand.latex()} (max relative error {error:.3g})")
+    print(f"Fitted {len(ns)} points.")
+    if flagged:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ import matplotlib.patches
 import matplotlib.pyplot as plt
 
 import dataclasses
+import functools
 import math
 import pathlib
 import numpy as np
@@ -43,19 +44,46 @@ class SimpleFormula:
     def is_b_sensitive(self):
         return bool(self.b or self.lg_n_over_b or self.n_over_b)
 
-    def value(self, n: int, b: int):
+    def value(self, n: int, b: int, o_1: Union[int, float, np.ndarray] = 10):
         return (
             self.n2 * n * n
             + self.n * n
             + self.sqrt_n * int(math.ceil(math.sqrt(n)))
             + self.lg_n * int(math.ceil(math.log2(n)))
             + self.constant
-            + (10 if self.O_1 else 0)
+            + (o_1 if self.O_1 else 0)
             + self.b * b
             + self.n_over_b * int(math.ceil(n / b))
             + self.lg_n_over_b * int(math.ceil(math.log2(max(n / b, 1))))
         )
 
+    # The coefficient fields, in the column order of `basis`.
+    TERMS = ('n2', 'n', 'sqrt_n', 'lg_n', 'constant', 'b', 'n_over_b', 'lg_n_over_b')
+
+    @staticmethod
+    def basis(ns: np.ndarray, bs: np.ndarray) -> np.ndarray:
+        """Evaluates each term of `value` at many (n, b) points. Returns a (points, len(TERMS)) matrix."""
+        ns = np.asarray(ns, dtype=np.int64)
+        bs = np.asarray(bs, dtype=np.int64)
+        n_over_b = -(-ns // bs)
+        return np.stack([
+            ns * ns,
+            ns,
+            np.ceil(np.sqrt(ns)),
+            np.ceil(np.log2(ns)),
+            np.ones(len(ns)),
+            bs,
+            n_over_b,
+            np.ceil(np.log2(np.maximum(ns / bs, 1))),
+        ], axis=1).astype(np.float64)
+
+    def sampled_value(self, n: int, b: int, samples: 'CostSamples') -> np.ndarray:
+        """Evaluates the formula once per sample of the uncertain constants."""
+        result = self.value(n, b, o_1=samples.o_1) * np.ones(samples.count)
+        if self.asterisk:
+            result *= samples.asterisk_scale
+        return result
+
     def latex(self) -> str:
 
         def factor(x: Union[int, float]) -> str:
@@ -92,44 +120,261 @@ class SimpleFormula:
         return result
 
 
+@dataclasses.dataclass
+class CostSamples:
+    """Samples of the constants that the cost model is unsure about.
+
+    Each index across the arrays is one self-consistent guess at the true costs, shared by every adder and block
+    size. The O(1) terms are drawn uniformly, asterisked (uncertain) formulas are scaled by a log-normal factor
+    with mean 1, and each layer of reaction time varies by a gamma distributed amount with the given coefficient of
+    variation. The reaction time jitter of a sample is fixed by one standard normal quantile, so different layer
+    counts see the same realization instead of independent draws.
+    """
+    o_1: np.ndarray
+    asterisk_scale: np.ndarray
+    reaction_jitter: float
+    reaction_quantile: np.ndarray
+
+    @property
+    def count(self) -> int:
+        return len(self.o_1)
+
+    @staticmethod
+    def sample(count: int,
+               *,
+               o_1_range: Tuple[float, float] = (0, 20),
+               asterisk_spread: float = 0.25,
+               reaction_jitter: float = 0.2,
+               seed: Optional[int] = None) -> 'CostSamples':
+        rng = np.random.default_rng(seed)
+        return CostSamples(
+            o_1=rng.uniform(*o_1_range, size=count),
+            # Centered so that the scale has mean 1 (rather than median 1), which keeps the expected cost nominal.
+            asterisk_scale=rng.lognormal(-asterisk_spread**2 / 2, asterisk_spread, size=count),
+            reaction_jitter=reaction_jitter,
+            reaction_quantile=rng.standard_normal(size=count),
+        )
+
+    def total_reaction_time(self, layers: np.ndarray, reaction_time: float) -> np.ndarray:
+        """The time taken by a sequence of layers whose individual durations jitter independently.
+
+        A sum of independent gamma distributed layer times is itself gamma distributed. Each sample's quantile is
+        mapped through that distribution using the Wilson-Hilferty approximation, which is accurate for the
+        hundreds of layers an addition takes.
+        """
+        layers = np.maximum(layers, 0)
+        if self.reaction_jitter == 0:
+            return layers * reaction_time
+        k = 1 / self.reaction_jitter**2
+        shape = np.maximum(layers * k, 1e-9)
+        c = 1 / (9 * shape)
+        cube = np.maximum(1 - c + self.reaction_quantile * np.sqrt(c), 0)
+        return shape * cube**3 * (reaction_time / k)
+
+
+# A Toffoli usage profile stored as (height, layer count) runs of consecutive layers with equal height.
+Runs = Tuple[Tuple[float, int], ...]
+
+
+def _compress(heights: List[float]) -> Runs:
+    result = []
+    for h in heights:
+        if result and result[-1][0] == h:
+            result[-1][1] += 1
+        else:
+            result.append([h, 1])
+    return tuple((h, c) for h, c in result)
+
+
+def _expand(runs: Runs) -> List[float]:
+    result = []
+    for h, c in runs:
+        result.extend([h] * c)
+    return result
+
+
+def _run_length(runs: Runs) -> int:
+    return sum(c for _, c in runs)
+
+
+def _append_run(result: List[List], h: float, c: int):
+    if c <= 0:
+        return
+    if result and result[-1][0] == h:
+        result[-1][1] += c
+    else:
+        result.append([h, c])
+
+
+def _overlap_runs(runs1: Runs, runs2: Runs, shift: int) -> Runs:
+    """Adds runs2, delayed by shift layers, onto runs1. Matches the list based `Tot.overlap`."""
+    if not runs2:
+        return runs1
+    if shift < 0:
+        # Negative list indices wrap around. Not worth reproducing without lists.
+        h1 = _expand(runs1)
+        h2 = _expand(runs2)
+        result = list(h1)
+        for k in range(len(h2)):
+            i = k + shift
+            while len(result) <= i:
+                result.append(0)
+            result[i] += h2[k]
+        return _compress(result)
+
+    # Only the layers covered by runs2 change. The untouched prefix and suffix of runs1 are reused as-is.
+    length1 = _run_length(runs1)
+    end = shift + _run_length(runs2)
+    result: List[List] = []
+    t = 0
+    i = 0
+    while i < len(runs1) and t + runs1[i][1] <= shift:
+        _append_run(result, *runs1[i])
+        t += runs1[i][1]
+        i += 1
+    # Split runs1 at the layers where runs2 starts and ends, then add the overlapping pieces.
+    rest1 = []
+    if i < len(runs1):
+        h, c = runs1[i]
+        _append_run(result, h, shift - t)
+        rest1.append((h, c - (shift - t)))
+        rest1.extend(runs1[i + 1:])
+    elif t < shift:
+        _append_run(result, 0, shift - t)
+    rest1.append((0, max(end - max(length1, shift), 0)))
+    j1 = 0
+    left1 = rest1[0][1]
+    for h2, c2 in runs2:
+        while c2 > 0:
+            while left1 == 0:
+                j1 += 1
+                left1 = rest1[j1][1]
+            c = min(c2, left1)
+            _append_run(result, rest1[j1][0] + h2, c)
+            c2 -= c
+            left1 -= c
+    if left1:
+        _append_run(result, rest1[j1][0], left1)
+    for h, c in rest1[j1 + 1:]:
+        _append_run(result, h, c)
+    return tuple((h, c) for h, c in result)
+
+
 class Tot:
-    def __init__(self, heights: Callable[[int, int], List[float]]):
-        self.heights = heights
+    """A per-layer profile (of Toffolis, or of live qubits) that depends on the register and block sizes.
+
+    Profiles are built as runs of equal-height layers and cached per (n, b). The runs of each `fold_down` and
+    `hold` are also cached by the values they actually depend on, so profiles for nearby register sizes or block
+    sizes share everything that didn't change, and combining them only touches the changed segments.
+    """
+
+    def __init__(self,
+                 heights: Optional[Callable[[int, int], List[float]]] = None,
+                 *,
+                 runs: Optional[Callable[[int, int], Runs]] = None):
+        if runs is None:
+            runs = lambda n, b: _compress(heights(n, b))
+        self.runs = functools.lru_cache(maxsize=4096)(runs)
+
+    def heights(self, n: int, b: int) -> List[float]:
+        return _expand(self.runs(n, b))
+
+    def layer_count(self, n: int, b: int) -> int:
+        return _run_length(self.runs(n, b))
 
     def simulate_supply(self, n: int, b: int, max_production_rate: float) -> Tuple[float, float, float]:
-        hs = self.heights(n, b)
-        supplies = []
+        average_supply, average_time, max_production_rate, _ = self.simulate_supply_and_space(
+            n, b, max_production_rate=max_production_rate)
+        return average_supply, average_time, max_production_rate
+
+    def simulate_supply_and_space(self,
+                                  n: int,
+                                  b: int,
+                                  max_production_rate: float,
+                                  space: Optional['Tot'] = None) -> Tuple[float, float, float, float]:
+        """Like `simulate_supply`, but also integrates a qubit occupancy profile over the simulated time.
+
+        Layer k of `space` stays live for as long as layer k of this profile takes, including stalls waiting for
+        Toffolis, so both profiles must have the same number of layers. The fourth returned value is the average
+        space-time (qubits times layers) per attempt.
+
+        The simulation walks the runs of the profile instead of a list of heights, and keeps running totals
+        instead of recording the supply at every step.
+        """
+        segments = self._segments(n, b, space)
         supply = 1000000
         time = 0
+        space_time = 0
+        supply_total = 0
         attempts = 4
         for k in range(3 + attempts):
             start_supply = supply
             start_time = time
-            for h in hs:
-                debt = h
-                time += 1
-                supplies.append(supply)
-                supply += max_production_rate
-                while debt > supply:
-                    # Stall.
-                    debt -= supply
-                    supplies.append(0)
-                    time += 1
-                    supply = max_production_rate
-                supply -= debt
+            lowest = supply
+            stalled = False
+            rate = max_production_rate
+            for h, s, c in segments:
+                # Every layer takes at least one step. Stall steps are added on as they happen.
+                time += c
+                space_time += s * c
+                for _ in range(c):
+                    supply_total += supply
+                    if supply < lowest:
+                        lowest = supply
+                    supply += rate
+                    if h > supply:
+                        debt = h
+                        while debt > supply:
+                            # Stall. The supply is recorded as 0 for this step.
+                            debt -= supply
+                            stalled = True
+                            time += 1
+                            space_time += s
+                            supply = rate
+                        supply -= debt
+                    else:
+                        supply -= h
 
             # Initially try to find stable supply and production values.
             if k < 3:
-                lowest = min(supplies + [supply])
+                lowest = min(lowest, supply)
+                if stalled:
+                    lowest = min(lowest, 0)
                 if lowest > 0:
                     if start_supply < supply:
                         max_production_rate -= (supply - start_supply) / (time - start_time) * 0.999
                     supply -= lowest
-                supplies.clear()
+                supply_total = 0
                 time = 0
-        average_supply = np.average(supplies)
+                space_time = 0
+        # Each step of the simulation recorded one supply value.
+        average_supply = supply_total / time if time else float('nan')
         average_time = time / attempts
-        return average_supply, average_time, max_production_rate
+        average_space_time = space_time / attempts
+        return average_supply, average_time, max_production_rate, average_space_time
+
+    def _segments(self, n: int, b: int, space: Optional['Tot']) -> List[Tuple[float, float, int]]:
+        """Splits the runs of this profile and of `space` into (height, space, layer count) pieces."""
+        runs = self.runs(n, b)
+        if space is None:
+            return [(h, 0, c) for h, c in runs]
+        space_runs = space.runs(n, b)
+        if _run_length(space_runs) != _run_length(runs):
+            raise ValueError(f"The space profile has {_run_length(space_runs)} layers but the Toffoli profile has "
+                             f"{_run_length(runs)} layers (n={n}, b={b}).")
+        result = []
+        j = -1
+        left = 0
+        for h, c in runs:
+            while c > 0:
+                while left == 0:
+                    j += 1
+                    left = space_runs[j][1]
+                taken = min(c, left)
+                result.append((h, space_runs[j][0], taken))
+                c -= taken
+                left -= taken
+        return result
 
     @staticmethod
     def sequence(*items: 'Tot') -> 'Tot':
@@ -139,39 +384,48 @@ class Tot:
         return result
 
     def __mul__(self, other: int) -> 'Tot':
-        return Tot(lambda n: [e * other for e in self.heights(n)])
+        return Tot(runs=lambda n, b: tuple((h * other, c) for h, c in self.runs(n, b)))
 
     def reversed(self):
-        return Tot(lambda n, b: self.heights(n, b)[::-1])
+        return Tot(runs=lambda n, b: self.runs(n, b)[::-1])
+
+    def flat(self, height: Union[int, float, SimpleFormula]) -> 'Tot':
+        """Returns a profile lasting as many layers as this one, but with a constant height."""
+        if isinstance(height, (int, float)):
+            height = SimpleFormula(constant=height)
+        return Tot(runs=lambda n, b: _hold_runs(height.value(n, b), self.layer_count(n, b)))
 
     def then(self, second: 'Tot', shift: int = 0) -> 'Tot':
-        def f(n: int, b: int) -> List[float]:
-            h1 = self.heights(n, b)
-            h2 = second.heights(n, b)
-            result = list(h1)
-            for k in range(len(h2)):
-                i = len(h1) + k + shift
-                while len(result) <= i:
-                    result.append(0)
-                result[i] += h2[k]
-            return result
-        return Tot(f)
+        return Tot(runs=lambda n, b: _overlap_runs(
+            self.runs(n, b),
+            second.runs(n, b),
+            self.layer_count(n, b) + shift))
 
     def tikz_plot(self, n: int, b: int) -> str:
         return tikz_plot(self.heights(n, b))
 
     def overlap(self, second: 'Tot', shift: int = 0):
-        def f(n: int, b: int) -> List[int]:
-            h1 = self.heights(n, b)
-            h2 = second.heights(n, b)
-            result = list(h1)
-            for k in range(len(h2)):
-                i = k + shift
-                while len(result) <= i:
-                    result.append(0)
-                result[i] += h2[k]
-            return result
-        return Tot(f)
+        return Tot(runs=lambda n, b: _overlap_runs(self.runs(n, b), second.runs(n, b), shift))
+
+
+@functools.lru_cache(maxsize=65536)
+def _fold_down_runs(k: int, scale: float, skip_end: int, reps: int, gap: int) -> Runs:
+    # The levels below k are exactly the levels of k >> 1, so register sizes that halve share them.
+    if k <= 2**skip_end:
+        return ()
+    result: List[List] = []
+    _append_run(result, k * scale, reps)
+    _append_run(result, 0, gap)
+    for h, c in _fold_down_runs(k >> 1, scale, skip_end, reps, gap):
+        _append_run(result, h, c)
+    return tuple((h, c) for h, c in result)
+
+
+@functools.lru_cache(maxsize=65536)
+def _hold_runs(height: float, count: int) -> Runs:
+    if count <= 0:
+        return ()
+    return ((height, count),)
 
 
 def fold_down(*,
@@ -181,19 +435,12 @@ def fold_down(*,
               width: SimpleFormula = SimpleFormula(n=1),
               reps: int = 1,
               gap: int = 0) -> Tot:
-    def f(n: int, b: int) -> List[float]:
-        result = []
+    def f(n: int, b: int) -> Runs:
         k = width.value(n, b)
         for _ in range(skip_start):
             k >>= 1
-        while k > 2**skip_end:
-            for _ in range(reps):
-                result.append(k * scale)
-            for _ in range(gap):
-                result.append(0)
-            k >>= 1
-        return result
-    return Tot(f)
+        return _fold_down_runs(k, scale, skip_end, reps, gap)
+    return Tot(runs=f)
 
 
 def hold(*, duration: Union[int, float, SimpleFormula], height: Union[int, float, SimpleFormula] = 1) -> Tot:
@@ -201,7 +448,38 @@ def hold(*, duration: Union[int, float, SimpleFormula], height: Union[int, float
         duration = SimpleFormula(constant=duration)
     if isinstance(height, (int, float)):
         height = SimpleFormula(constant=height)
-    return Tot(lambda n, b: [height.value(n, b)] * int(math.ceil(duration.value(n, b))))
+    return Tot(runs=lambda n, b: _hold_runs(height.value(n, b), int(math.ceil(duration.value(n, b)))))
+
+
+@dataclasses.dataclass
+class PruneStats:
+    evaluated: int = 0
+    skipped: int = 0
+
+
+def min_by_lower_bounds(bounds: List[float],
+                        evaluate: Callable[[int], float],
+                        stats: Optional[PruneStats] = None) -> Tuple[float, int]:
+    """Returns the least `evaluate(k)` and its index k, skipping indices whose lower bound can't beat the best so far.
+
+    Indices are evaluated in order of increasing bound. Ties go to the lowest index, exactly like taking the `min`
+    over all of them.
+    """
+    best: Optional[Tuple[float, int]] = None
+    order = sorted(range(len(bounds)), key=lambda k: bounds[k])
+    for e, k in enumerate(order):
+        # Leave slack for rounding, so that pruning never changes the result.
+        if best is not None and bounds[k] * (1 - 1e-9) > best[0]:
+            # Every remaining bound is at least as large.
+            if stats is not None:
+                stats.skipped += len(order) - e
+            break
+        if stats is not None:
+            stats.evaluated += 1
+        candidate = (evaluate(k), k)
+        if best is None or candidate < best:
+            best = candidate
+    return best
 
 
 DEFAULT_N = 128
@@ -219,6 +497,8 @@ class Adder:
     reaction_depth: SimpleFormula
     workspace: SimpleFormula
     toffoli_usage: Optional[Tot] = None
+    # Per-layer workspace occupancy, aligned with the layers of `toffoli_usage`. Overrides `workspace` in volumes.
+    workspace_usage: Optional[Tot] = None
     dominated_in_phase_diagram: bool = False
 
     def toffoli_usage_or_def(self, n: int, b: int) -> Tot:
@@ -228,6 +508,10 @@ class Adder:
             return hold(duration=t, height=v / t)
         return self.toffoli_usage
 
+    @property
+    def label(self) -> str:
+        return f"{self.author} ({self.year}) {self.type} {'in' if self.in_place else 'out'}"
+
     def toffoli_usage_tikz_plot(self) -> str:
         return self.toffoli_usage_or_def(DEFAULT_N, DEFAULT_B).tikz_plot(DEFAULT_N, DEFAULT_B)
 
@@ -245,23 +529,116 @@ class Adder:
             factory_period: float = 165,
             factory_area: float = 12 * 6,
             reaction_time: float = 10) -> float:
-        if self.is_b_sensitive():
-            bs = range(2, n + 1)
-            if len(bs) > 50:
-                bs = list(range(2, 50))
-                while bs[-1] < n / 2:
-                    bs.append(int(bs[-1] * 1.2))
-        else:
-            bs = [DEFAULT_B]
-        return min(self.vol_b(
+        return self.vol_and_b(
             n=n,
-            b=b,
             factory_count=factory_count,
             factory_period=factory_period,
             factory_area=factory_area,
-            reaction_time=reaction_time)
+            reaction_time=reaction_time)[0]
+
+    def vol_and_b(self,
+                  *,
+                  n: int,
+                  factory_count: int,
+                  factory_period: float = 165,
+                  factory_area: float = 12 * 6,
+                  reaction_time: float = 10) -> Tuple[float, int]:
+        """Returns the minimum volume over block sizes, and the block size achieving it.
+
+        Block sizes whose `vol_b_lower_bound` exceeds the best volume found so far are not simulated (see
+        `min_by_lower_bounds`).
+        """
+        bs = self.block_sizes(n)
+        bounds = [
+            self.vol_b_lower_bound(
+                n=n,
+                b=b,
+                factory_period=factory_period,
+                factory_area=factory_area,
+                reaction_time=reaction_time)
             for b in bs
+        ]
+        volume, k = min_by_lower_bounds(bounds, lambda k: self.vol_b(
+            n=n,
+            b=bs[k],
+            factory_count=factory_count,
+            factory_period=factory_period,
+            factory_area=factory_area,
+            reaction_time=reaction_time))
+        return volume, bs[k]
+
+    def vol_b_lower_bound(self,
+                          *,
+                          n: int,
+                          b: int,
+                          factory_period: float = 165,
+                          factory_area: float = 12 * 6,
+                          reaction_time: float = 10) -> float:
+        """A cheap lower bound on `vol_b` that skips the supply simulation.
+
+        Distillation cost is exact, but the space omits the buffered supply and the time only counts the layers of
+        the Toffoli usage profile (no stalls). Both omissions can only make the volume smaller.
+        """
+        extra_space = 2*n if self.in_place else 3*n
+        layers = self.toffoli_usage_or_def(n, b).layer_count(n, b)
+        if self.workspace_usage is None:
+            space_time = max(self.workspace.value(n, b) + extra_space, 0) * layers
+        else:
+            space_time = extra_space * layers + sum(max(s, 0) * c for s, c in self.workspace_usage.runs(n, b))
+        result = (
+            factory_area * factory_period * self.toffolis.value(n, b)
+            + space_time * reaction_time
         )
+        result /= 1000 * 1000  # Microseconds to seconds.
+        return result
+
+    def vol_lower_bound(self,
+                        *,
+                        n: int,
+                        factory_period: float = 165,
+                        factory_area: float = 12 * 6,
+                        reaction_time: float = 10) -> float:
+        """A cheap lower bound on `vol`, the least `vol_b_lower_bound` over the scanned block sizes."""
+        return min(
+            self.vol_b_lower_bound(
+                n=n,
+                b=b,
+                factory_period=factory_period,
+                factory_area=factory_area,
+                reaction_time=reaction_time)
+            for b in self.block_sizes(n)
+        )
+
+    def block_sizes(self, n: int) -> List[int]:
+        if not self.is_b_sensitive():
+            return [DEFAULT_B]
+        bs = list(range(2, n + 1))
+        if len(bs) > 50:
+            bs = list(range(2, 50))
+            while bs[-1] < n / 2:
+                bs.append(int(bs[-1] * 1.2))
+        return bs
+
+    def vol_samples(self,
+                    *,
+                    n: int,
+                    factory_count: int,
+                    samples: CostSamples,
+                    factory_period: float = 165,
+                    factory_area: float = 12 * 6,
+                    reaction_time: float = 10) -> np.ndarray:
+        """Like `vol`, but returns one volume per sample with the best block size picked separately per sample."""
+        return np.min([
+            self.vol_b_samples(
+                n=n,
+                b=b,
+                factory_count=factory_count,
+                samples=samples,
+                factory_period=factory_period,
+                factory_area=factory_area,
+                reaction_time=reaction_time)
+            for b in self.block_sizes(n)
+        ], axis=0)
 
     def vol_b(self,
             *,
@@ -273,20 +650,94 @@ class Adder:
             reaction_time: float = 10) -> float:
         tof = self.toffolis.value(n, b)
         dep = self.reaction_depth.value(n, b)
-        space = self.workspace.value(n, b)
-        average_supply, average_time, max_production_rate = self.toffoli_usage_or_def(n, b).simulate_supply(
-            n, b, max_production_rate=factory_count / factory_period * reaction_time)
+        space = self.workspace.value(n, b) if self.workspace_usage is None else 0
+        average_supply, average_time, max_production_rate, average_space_time = (
+            self.toffoli_usage_or_def(n, b).simulate_supply_and_space(
+                n, b, max_production_rate=factory_count / factory_period * reaction_time, space=self.workspace_usage))
         space += average_supply
         if self.in_place:
             space += 2*n
         else:
             space += 3*n
         time = average_time * reaction_time
+        result = factory_area * factory_period * tof + space * time + average_space_time * reaction_time
+        result /= 1000 * 1000  # Microseconds to seconds.
+        return result
+
+    def vol_b_samples(self,
+                      *,
+                      n: int,
+                      b: int,
+                      factory_count: float,
+                      samples: CostSamples,
+                      factory_period: float = 165,
+                      factory_area: float = 12 * 6,
+                      reaction_time: float = 10) -> np.ndarray:
+        """Like `vol_b`, but evaluates all samples in one batched pass.
+
+        The supply simulation is run once with the nominal constants. Sampled changes to the reaction depth are
+        added on as extra (or fewer) layers, and the jitter of every layer is applied when converting layers into
+        time.
+        """
+        tof = self.toffolis.sampled_value(n, b, samples)
+        dep = self.reaction_depth.sampled_value(n, b, samples)
+        average_supply, average_time, max_production_rate, average_space_time = (
+            self.toffoli_usage_or_def(n, b).simulate_supply_and_space(
+                n, b, max_production_rate=factory_count / factory_period * reaction_time, space=self.workspace_usage))
+        if self.workspace_usage is None:
+            space = self.workspace.sampled_value(n, b, samples)
+        else:
+            # Average occupancy, so that the sampled time stretches the workspace integral too. The profile is
+            # evaluated with the nominal O(1). Every layer of the profiles in `make_adders` holds one formula with
+            # the same O(1) as `workspace`, so the sampled change of `workspace` is also the change of the occupancy.
+            space = average_space_time / average_time
+            space += self.workspace.sampled_value(n, b, samples) - self.workspace.value(n, b)
+        space += average_supply
+        if self.in_place:
+            space += 2*n
+        else:
+            space += 3*n
+        layers = average_time + dep - self.reaction_depth.value(n, b)
+        time = samples.total_reaction_time(layers, reaction_time)
         result = factory_area * factory_period * tof + space * time
         result /= 1000 * 1000  # Microseconds to seconds.
         return result
 
 
+VolumeFn = Callable[[Adder, int, int, float], float]
+# Takes an adder, register size and distance scale. Must not exceed the matching `VolumeFn` for any factory count.
+VolumeBoundFn = Callable[[Adder, int, float], float]
+
+
+def compute_vol(adder: Adder, n: int, factory_count: int, d: float = 1.0) -> float:
+    """Evaluates an adder's volume using factories scaled to relative code distance d."""
+    return adder.vol(n=n, factory_count=factory_count, factory_area=12 * 6 * d**2, factory_period=165 * d)
+
+
+def compute_vol_lower_bound(adder: Adder, n: int, d: float = 1.0) -> float:
+    """A lower bound on `compute_vol`, for any factory count."""
+    return adder.vol_lower_bound(n=n, factory_area=12 * 6 * d**2, factory_period=165 * d)
+
+
+def best_adder_index(adder_set: List[Adder],
+                     *,
+                     n: int,
+                     factory_count: int,
+                     d: float,
+                     vol: VolumeFn = compute_vol,
+                     lower_bound: VolumeBoundFn = compute_vol_lower_bound,
+                     stats: Optional[PruneStats] = None) -> int:
+    """Returns the index of the adder minimizing `vol`, skipping adders whose lower bound can't win.
+
+    `lower_bound` must bound `vol`, i.e. both must use the same cost constants.
+    """
+    _, k = min_by_lower_bounds(
+        [lower_bound(adder, n, d) for adder in adder_set],
+        lambda k: vol(adder_set[k], n, factory_count, d),
+        stats)
+    return k
+
+
 def tikz_plot(heights: List[float]):
     def fy(v):
         if v == 0:
@@ -311,7 +762,10 @@ def tikz_plot(heights: List[float]):
     return start + center + end
 
 
-def make_table(adders: List[Adder]) -> str:
+TABLE_PARAMS = [(100, 10), (1000, 100), (10000, 1000)]
+
+
+def make_table(adders: List[Adder], vol: VolumeFn = compute_vol) -> str:
     in_place_adders = [adder for adder in adders if adder.in_place]
     out_of_place_adders = [adder for adder in adders if not adder.in_place]
     in_place_row = 2
@@ -319,7 +773,7 @@ def make_table(adders: List[Adder]) -> str:
     diagram = cirq.TextDiagramDrawer()
     diagram.write(0, in_place_row - 1, r"\hline")
     diagram.write(0, out_of_place_row - 1, r"\hline")
-    params = [(100, 10), (1000, 100), (10000, 1000)]
+    params = TABLE_PARAMS
     vol_col = 7
     last_col = vol_col + len(params)
 
@@ -343,7 +797,7 @@ def make_table(adders: List[Adder]) -> str:
             diagram.write(5, row + r, '&' + adder.workspace.latex())
             diagram.write(6, row + r, '&' + adder.toffoli_usage_tikz_plot())
             for c, (n, f) in enumerate(params):
-                v = str(int(adder.vol(n=n, factory_count=f)))
+                v = str(int(vol(adder, n, f, 1.0)))
                 if len(v) > 2:
                     v = v[:2] + '0' * (len(v) - 2)
                 diagram.write(vol_col + c, row + r, '&' + v)
@@ -352,14 +806,8 @@ def make_table(adders: List[Adder]) -> str:
     return r"\begin{tabular}{r|c|c|l|l|l|l" + '|c' * len(params) + "}\n" + contents + "\n\end{tabular}"
 
 
-def plot_phase_diagram(adders: List[Adder], out_dir: pathlib.Path):
-    adders = [adder for adder in adders if not adder.dominated_in_phase_diagram]
-    in_place_adders = [adder for adder in adders if adder.in_place]
-    out_of_place_adders = [adder for adder in adders if not adder.in_place]
-
+def phase_diagram_grid(max_n: int = 20000, g: float = 1.5) -> Tuple[List[int], List[int]]:
     register_sizes = [8]
-    g = 1.5
-    max_n = 20000
     max_f = max_n
     while register_sizes[-1] < max_n:
         register_sizes.append(int(math.ceil(register_sizes[-1] * g)))
@@ -368,30 +816,53 @@ def plot_phase_diagram(adders: List[Adder], out_dir: pathlib.Path):
     while factory_counts[-1] < max_f:
         factory_counts.append(int(math.ceil(factory_counts[-1] * g)))
     factory_counts[-1] = max_f
-    plot_phase_diagram_helper(out_of_place_adders,
-                              "Min-volume out-of-place adder vs size and factories",
-                              filepath=out_dir / 'out-of-place-min-vol.pdf',
-                              d=1.0,
-                              factory_counts=factory_counts,
-                              register_sizes=register_sizes)
-    plot_phase_diagram_helper(in_place_adders,
-                              "Min-volume in-place adder vs size and factories",
-                              filepath=out_dir / 'in-place-min-vol.pdf',
-                              d=1.0,
-                              factory_counts=factory_counts,
-                              register_sizes=register_sizes)
-    plot_phase_diagram_helper(out_of_place_adders,
-                              "Min-volume out-of-place adder vs size and half-distance factories",
-                              filepath=out_dir / 'out-of-place-min-vol-half.pdf',
-                              d=0.5,
-                              factory_counts=factory_counts,
-                              register_sizes=register_sizes)
-    plot_phase_diagram_helper(in_place_adders,
-                              "Min-volume in-place adder vs size and half-distance factories",
-                              filepath=out_dir / 'in-place-min-vol-half.pdf',
-                              d=0.5,
-                              factory_counts=factory_counts,
-                              register_sizes=register_sizes)
+    return register_sizes, factory_counts
+
+
+def phase_diagram_sweeps(adders: List[Adder]) -> List[Tuple[List[Adder], str, str, float]]:
+    """Returns the (adder set, title, file name, factory distance scale) of each phase diagram."""
+    adders = [adder for adder in adders if not adder.dominated_in_phase_diagram]
+    in_place_adders = [adder for adder in adders if adder.in_place]
+    out_of_place_adders = [adder for adder in adders if not adder.in_place]
+    return [
+        (out_of_place_adders,
+         "Min-volume out-of-place adder vs size and factories",
+         'out-of-place-min-vol.pdf',
+         1.0),
+        (in_place_adders,
+         "Min-volume in-place adder vs size and factories",
+         'in-place-min-vol.pdf',
+         1.0),
+        (out_of_place_adders,
+         "Min-volume out-of-place adder vs size and half-distance factories",
+         'out-of-place-min-vol-half.pdf',
+         0.5),
+        (in_place_adders,
+         "Min-volume in-place adder vs size and half-distance factories",
+         'in-place-min-vol-half.pdf',
+         0.5),
+    ]
+
+
+def plot_phase_diagram(adders: List[Adder],
+                       out_dir: pathlib.Path,
+                       vol: VolumeFn = compute_vol,
+                       prune: bool = True,
+                       register_sizes: Optional[List[int]] = None,
+                       factory_counts: Optional[List[int]] = None,
+                       lower_bound: Optional[VolumeBoundFn] = None):
+    if register_sizes is None or factory_counts is None:
+        register_sizes, factory_counts = phase_diagram_grid()
+    for adder_set, title, file_name, d in phase_diagram_sweeps(adders):
+        plot_phase_diagram_helper(adder_set,
+                                  title,
+                                  filepath=out_dir / file_name,
+                                  d=d,
+                                  factory_counts=factory_counts,
+                                  register_sizes=register_sizes,
+                                  vol=vol,
+                                  prune=prune,
+                                  lower_bound=lower_bound)
 
 
 def plot_phase_diagram_helper(adder_set: List[Adder],
@@ -399,26 +870,70 @@ def plot_phase_diagram_helper(adder_set: List[Adder],
                               filepath: pathlib.Path,
                               d: float,
                               factory_counts: List[int],
-                              register_sizes: List[int]):
-    data = np.zeros(shape=(len(factory_counts), len(register_sizes)), dtype=np.int32)
+                              register_sizes: List[int],
+                              data: Optional[np.ndarray] = None,
+                              vol: VolumeFn = compute_vol,
+                              prune: bool = True,
+                              lower_bound: Optional[VolumeBoundFn] = None):
+    """Plots the index of the min-volume adder for each (factory count, register size) cell.
+
+    If `data` is given it is used as the precomputed grid of winning indices (e.g. merged from a sharded sweep)
+    instead of evaluating every adder here. If `prune` is set, adders whose lower bound shows that they can't win a
+    cell are not evaluated for that cell. Pruning a `vol` other than `compute_vol` needs its matching `lower_bound`.
+    """
+    if prune and data is None and lower_bound is None:
+        if vol is not compute_vol:
+            raise ValueError("Pruning a custom vol needs a lower_bound matching it. Pass one, or prune=False.")
+        lower_bound = compute_vol_lower_bound
+    if data is None:
+        data = np.zeros(shape=(len(factory_counts), len(register_sizes)), dtype=np.int32)
+        stats = PruneStats()
+        print("#" * len(register_sizes))
+        for i, n in enumerate(register_sizes):
+            print(".", end='')
+            for j, f in enumerate(factory_counts):
+                if prune:
+                    data[j, i] = best_adder_index(adder_set,
+                                                  n=n,
+                                                  factory_count=f,
+                                                  d=d,
+                                                  vol=vol,
+                                                  lower_bound=lower_bound,
+                                                  stats=stats)
+                else:
+                    data[j, i] = min(range(len(adder_set)), key=lambda k: vol(adder_set[k], n, f, d))
+        print()
+        if prune:
+            print(f"Skipped {stats.skipped} of {stats.skipped + stats.evaluated} adder evaluations.")
     fig: matplotlib.figure.Figure = plt.figure()
     colors = plt.get_cmap('tab10')
     ax: matplotlib.axes.Axes = fig.add_subplot(1, 1, 1)
-    print("#" * len(register_sizes))
-    for i, n in enumerate(register_sizes):
-        print(".", end='')
-        for j, f in enumerate(factory_counts):
-            data[j, i] = min(range(len(adder_set)),
-                             key=lambda k: adder_set[k].vol(n=n, factory_count=f,
-                                                            factory_area=12 * 6 * d**2,
-                                                            factory_period= 165 * d))
-    print()
     data = data[::-1, :]
     ax.imshow(data, cmap=colors, vmin=0, vmax=len(colors.colors))
     ax.set_title(title)
     fig.set_size_inches(12, 5)
     ax.set_ylabel(r'Maximum factory count (f)')
     ax.set_xlabel(r'Register size (n)')
+    set_log_ticks(ax, data.shape, factory_counts=factory_counts, register_sizes=register_sizes)
+
+    ax.legend(
+        handles=[
+            matplotlib.patches.Patch(
+                color=color,
+                label=f"{adder.author} ({adder.year}) {adder.type}".replace('=b', '=best'))
+            for adder, color in zip(adder_set, colors.colors)
+        ],
+        bbox_to_anchor=(1.95, 1),
+        loc='upper right')
+
+    plt.savefig(filepath)
+    print(f"Generated file://{filepath}")
+
+
+def set_log_ticks(ax: matplotlib.axes.Axes,
+                  shape: Tuple[int, ...],
+                  factory_counts: List[int],
+                  register_sizes: List[int]):
     yt = [10**k for k in range(20) if factory_counts[0] < 10**k < factory_counts[-1]]
     xt = [10**k for k in range(20) if register_sizes[0] < 10**k < register_sizes[-1]]
 
@@ -426,15 +941,15 @@ def plot_phase_diagram_helper(adder_set: List[Adder],
         return (
                 (math.log(x) - math.log(register_sizes[0]))
                 / (math.log(register_sizes[-1]) - math.log(register_sizes[0]))
-                * data.shape[1]
+                * shape[1]
         )
 
     def logify(y):
         return (
-            data.shape[0] - 1 -
+            shape[0] - 1 -
                 (math.log(y) - math.log(factory_counts[0]))
                 / (math.log(factory_counts[-1]) - math.log(factory_counts[0]))
-                * data.shape[0]
+                * shape[0]
         )
 
     ax.set_xticks([logifx(x) for x in xt])
@@ -442,35 +957,118 @@ def plot_phase_diagram_helper(adder_set: List[Adder],
     ax.set_xticklabels([str(x) for x in xt])
     ax.set_yticklabels([str(y) for y in yt])
 
-    ax.legend(
-        handles=[
-            matplotlib.patches.Patch(
-                color=color,
-                label=f"{adder.author} ({adder.year}) {adder.type}".replace('=b', '=best'))
-            for adder, color in zip(adder_set, colors.colors)
-        ],
-        bbox_to_anchor=(1.95, 1),
-        loc='upper right')
+
+WinProbabilityFn = Callable[[List[Adder], int, int, float], np.ndarray]
+
+
+def plot_win_probability(adders: List[Adder],
+                         out_dir: pathlib.Path,
+                         samples: CostSamples,
+                         win_probability: Optional[WinProbabilityFn] = None,
+                         register_sizes: Optional[List[int]] = None,
+                         factory_counts: Optional[List[int]] = None):
+    """Plots a win probability map alongside each argmin phase diagram of `plot_phase_diagram`."""
+    if register_sizes is None or factory_counts is None:
+        register_sizes, factory_counts = phase_diagram_grid()
+    for adder_set, title, file_name, d in phase_diagram_sweeps(adders):
+        plot_win_probability_helper(adder_set,
+                                    title.replace("Min-volume", "Probability of being the min-volume"),
+                                    filepath=out_dir / file_name.replace('min-vol', 'win-probability'),
+                                    d=d,
+                                    samples=samples,
+                                    factory_counts=factory_counts,
+                                    register_sizes=register_sizes,
+                                    win_probability=win_probability)
+
+
+def win_probabilities(adder_set: List[Adder],
+                      *,
+                      n: int,
+                      factory_count: int,
+                      samples: CostSamples,
+                      d: float = 1.0) -> np.ndarray:
+    """Returns the fraction of samples in which each adder has the smallest volume."""
+    volumes = np.array([
+        adder.vol_samples(n=n,
+                          factory_count=factory_count,
+                          samples=samples,
+                          factory_area=12 * 6 * d**2,
+                          factory_period=165 * d)
+        for adder in adder_set
+    ])
+    winners = np.argmin(volumes, axis=0)
+    return np.bincount(winners, minlength=len(adder_set)) / samples.count
+
+
+def plot_win_probability_helper(adder_set: List[Adder],
+                                title: str,
+                                filepath: pathlib.Path,
+                                d: float,
+                                samples: CostSamples,
+                                factory_counts: List[int],
+                                register_sizes: List[int],
+                                win_probability: Optional[WinProbabilityFn] = None):
+    """Plots each adder's win probability over the (factory count, register size) grid.
+
+    If `win_probability` is given it is used to look up the probabilities (e.g. from a stored dataset) instead of
+    evaluating the samples here.
+    """
+    if win_probability is None:
+        win_probability = lambda adder_set, n, f, d: win_probabilities(
+            adder_set, n=n, factory_count=f, samples=samples, d=d)
+    data = np.zeros(shape=(len(adder_set), len(factory_counts), len(register_sizes)), dtype=np.float64)
+    print("#" * len(register_sizes))
+    for i, n in enumerate(register_sizes):
+        print(".", end='')
+        for j, f in enumerate(factory_counts):
+            data[:, j, i] = win_probability(adder_set, n, f, d)
+    print()
+    data = data[:, ::-1, :]
+
+    cols = 2
+    rows = int(math.ceil(len(adder_set) / cols))
+    fig: matplotlib.figure.Figure = plt.figure()
+    fig.set_size_inches(12, 3 * rows)
+    fig.suptitle(f"{title} ({samples.count} samples per cell)")
+    image = None
+    for k, adder in enumerate(adder_set):
+        ax: matplotlib.axes.Axes = fig.add_subplot(rows, cols, k + 1)
+        image = ax.imshow(data[k], cmap='viridis', vmin=0, vmax=1)
+        ax.set_title(f"{adder.author} ({adder.year}) {adder.type}".replace('=b', '=best'), fontsize=8)
+        set_log_ticks(ax, data[k].shape, factory_counts=factory_counts, register_sizes=register_sizes)
+        if k % cols == 0:
+            ax.set_ylabel(r'Factories (f)')
+        if k >= len(adder_set) - cols:
+            ax.set_xlabel(r'Register size (n)')
+    if image is not None:
+        fig.colorbar(image, ax=fig.axes, label='Win probability')
 
     plt.savefig(filepath)
     print(f"Generated file://{filepath}")
 
 
-def plot_volume_vs_size(adders: List[Adder], out_dir: pathlib.Path):
-    in_place_adders = [adder for adder in adders if adder.in_place]
-    out_of_place_adders = [adder for adder in adders if not adder.in_place]
-
+def volume_vs_size_points() -> List[Tuple[int, int]]:
+    """Returns the (register size, factory count) points of the volume vs size curves."""
     ns = [32]
     max_n = 100000
     while ns[-1] < max_n:
         ns.append(int(ns[-1] * 2))
     ns[-1] = max_n
+    return [(n, int(math.ceil(n*0.1))) for n in ns]
+
+
+def plot_volume_vs_size(adders: List[Adder], out_dir: pathlib.Path, vol: VolumeFn = compute_vol):
+    in_place_adders = [adder for adder in adders if adder.in_place]
+    out_of_place_adders = [adder for adder in adders if not adder.in_place]
+
+    points = volume_vs_size_points()
+    ns = [n for n, _ in points]
     for name, adder_set in [('Out-of-place', out_of_place_adders), ('In-place', in_place_adders)]:
         curves = []
         for adder in adder_set:
             volumes = []
-            for n in ns:
-                volumes.append(adder.vol(n=n, factory_count=int(math.ceil(n*0.1))))
+            for n, f in points:
+                volumes.append(vol(adder, n, f, 1.0))
             curves.append((adder, volumes))
         fig: matplotlib.figure.Figure = plt.figure()
         ax: matplotlib.axes.Axes = fig.add_subplot(1, 1, 1)
@@ -488,7 +1086,7 @@ def plot_volume_vs_size(adders: List[Adder], out_dir: pathlib.Path):
         print(f"Generated file://{path}")
 
 
-def main():
+def make_adders() -> List[Adder]:
     draper_lookahead_usage = Tot.sequence(
         # Prepare initial carries.
         hold(duration=1, height=SimpleFormula(n=1)),
@@ -659,6 +1257,39 @@ def main():
     thapliyal_usage_inplace = thapliyal_usage_out_of_place.then(
         thapliyal_usage_out_of_place.reversed())
 
+    def block_workspace(duration: SimpleFormula,
+                        spread: Tot,
+                        spread_uncompute: Tot,
+                        registers: SimpleFormula,
+                        lookahead: SimpleFormula) -> Tot:
+        return Tot.sequence(
+            # Case blocks (mux_0, mux_1) and block carries stay live for the whole addition.
+            hold(duration=duration, height=registers),
+            # The carry-lookahead's range propagate workspace is only live during the lookahead.
+            spread.flat(lookahead),
+            hold(duration=duration, height=registers),
+            spread_uncompute.flat(lookahead),
+            hold(duration=duration, height=registers),
+        )
+    our_block_workspace = block_workspace(
+        SimpleFormula(b=1),
+        our_lookahead_usage_block_spread,
+        our_lookahead_usage_block_spread_uncompute,
+        registers=SimpleFormula(n=2, n_over_b=2, O_1=True),
+        lookahead=SimpleFormula(n=2, n_over_b=3, O_1=True))
+    our_sqrt_workspace = block_workspace(
+        SimpleFormula(sqrt_n=1),
+        our_lookahead_usage_sqrt_spread,
+        our_lookahead_usage_sqrt_spread_uncompute,
+        registers=SimpleFormula(n=2, sqrt_n=2, O_1=True),
+        lookahead=SimpleFormula(n=2, sqrt_n=3, O_1=True))
+    our_sqrt_workspace_uncompute = block_workspace(
+        SimpleFormula(sqrt_n=1),
+        our_lookahead_usage_block_spread,
+        our_lookahead_usage_block_spread_uncompute,
+        registers=SimpleFormula(n=2, sqrt_n=2, O_1=True),
+        lookahead=SimpleFormula(n=2, sqrt_n=3, O_1=True))
+
     adders = [
         Adder(
             author="Cuccaro",
@@ -733,7 +1364,8 @@ def main():
             toffolis=SimpleFormula(n=3, b=-2, n_over_b=5, O_1=True),
             reaction_depth=SimpleFormula(b=3, lg_n_over_b=2, O_1=True),
             workspace=SimpleFormula(n=2, n_over_b=3, O_1=True),
-            toffoli_usage=our_block_usage
+            toffoli_usage=our_block_usage,
+            workspace_usage=our_block_workspace,
         ),
         Adder(
             author="(this paper)",
@@ -745,6 +1377,7 @@ def main():
             reaction_depth=SimpleFormula(b=6, lg_n_over_b=4, O_1=True),
             workspace=SimpleFormula(n=2, n_over_b=3, O_1=True),
             toffoli_usage=our_block_usage.then(our_block_usage_uncompute),
+            workspace_usage=our_block_workspace.then(our_block_workspace),
         ),
         # Adder(
         #     author="(this paper)",
@@ -780,6 +1413,7 @@ def main():
             reaction_depth=SimpleFormula(sqrt_n=6, lg_n=2, O_1=True),
             workspace=SimpleFormula(n=2, sqrt_n=3, O_1=True),
             toffoli_usage=our_sqrt_usage.then(our_sqrt_usage_uncompute),
+            workspace_usage=our_sqrt_workspace.then(our_sqrt_workspace_uncompute),
             dominated_in_phase_diagram=True,
         ),
         Adder(
@@ -792,6 +1426,7 @@ def main():
             reaction_depth=SimpleFormula(sqrt_n=3, lg_n=1, O_1=True),
             workspace=SimpleFormula(n=2, sqrt_n=3, O_1=True),
             toffoli_usage=our_sqrt_usage,
+            workspace_usage=our_sqrt_workspace,
             dominated_in_phase_diagram=True,
         ),
         Adder(
@@ -844,15 +1479,18 @@ def main():
         adder.year,
         adder.author,
         adder.type))
+    return adders
+
+
+def main():
+    # The dataset module builds on this one, so it can only be imported once this module has loaded.
+    from dataset import create_figure_dataset, render
 
+    adders = make_adders()
     out_dir = pathlib.Path(__file__).parent.parent / 'gen'
-    comparison_table_tex = make_table(adders)
-    comp_path = out_dir / 'comparison_table.tex'
-    with open(comp_path, 'w') as f:
-        print(comparison_table_tex, file=f)
-    print(f"Generated file://{comp_path}")
-    plot_volume_vs_size(adders, out_dir)
-    plot_phase_diagram(adders, out_dir)
+    dataset = create_figure_dataset(out_dir / 'dataset', adders)
+    render(adders, dataset, out_dir, compute=True)
+    dataset.flush()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,245 @@
+"""A frozen copy of the cost model that produced the figures in `gen/`.
+
+Do not optimize or otherwise edit this file. It is the reference that faster implementations of the cost model in
+`generate_figures.py` are checked against by `differential_check.py`.
+"""
+
+from typing import Callable, Union, List, Optional, Tuple
+
+import dataclasses
+import math
+import numpy as np
+
+
+
+@dataclasses.dataclass
+class SimpleFormula:
+    O_1: bool = False
+    b: Union[int, float] = 0
+    n_over_b: Union[int, float] = 0
+    lg_n_over_b: Union[int, float] = 0
+    constant: Union[int, float] = 0
+    lg_n: Union[int, float] = 0
+    sqrt_n: Union[int, float] = 0
+    n: Union[int, float] = 0
+    n2: Union[int, float] = 0
+    asterisk: str = ''
+
+    def __mul__(self, other: Union[int, float]) -> 'SimpleFormula':
+        return SimpleFormula(
+            O_1=self.O_1,
+            b=self.b * other,
+            n_over_b=self.n_over_b * other,
+            lg_n_over_b=self.lg_n_over_b * other,
+            constant=self.constant * other,
+            lg_n=self.lg_n * other,
+            sqrt_n=self.sqrt_n * other,
+            n=self.n * other,
+            n2=self.n2 * other,
+            asterisk=self.asterisk,
+        )
+
+    def is_b_sensitive(self):
+        return bool(self.b or self.lg_n_over_b or self.n_over_b)
+
+    def value(self, n: int, b: int):
+        return (
+            self.n2 * n * n
+            + self.n * n
+            + self.sqrt_n * int(math.ceil(math.sqrt(n)))
+            + self.lg_n * int(math.ceil(math.log2(n)))
+            + self.constant
+            + (10 if self.O_1 else 0)
+            + self.b * b
+            + self.n_over_b * int(math.ceil(n / b))
+            + self.lg_n_over_b * int(math.ceil(math.log2(max(n / b, 1))))
+        )
+
+
+class Tot:
+    def __init__(self, heights: Callable[[int, int], List[float]]):
+        self.heights = heights
+
+    def simulate_supply(self, n: int, b: int, max_production_rate: float) -> Tuple[float, float, float]:
+        hs = self.heights(n, b)
+        supplies = []
+        supply = 1000000
+        time = 0
+        attempts = 4
+        for k in range(3 + attempts):
+            start_supply = supply
+            start_time = time
+            for h in hs:
+                debt = h
+                time += 1
+                supplies.append(supply)
+                supply += max_production_rate
+                while debt > supply:
+                    # Stall.
+                    debt -= supply
+                    supplies.append(0)
+                    time += 1
+                    supply = max_production_rate
+                supply -= debt
+
+            # Initially try to find stable supply and production values.
+            if k < 3:
+                lowest = min(supplies + [supply])
+                if lowest > 0:
+                    if start_supply < supply:
+                        max_production_rate -= (supply - start_supply) / (time - start_time) * 0.999
+                    supply -= lowest
+                supplies.clear()
+                time = 0
+        average_supply = np.average(supplies)
+        average_time = time / attempts
+        return average_supply, average_time, max_production_rate
+
+    @staticmethod
+    def sequence(*items: 'Tot') -> 'Tot':
+        result = items[0]
+        for item in items[1:]:
+            result = result.then(item)
+        return result
+
+    def __mul__(self, other: int) -> 'Tot':
+        return Tot(lambda n: [e * other for e in self.heights(n)])
+
+    def reversed(self):
+        return Tot(lambda n, b: self.heights(n, b)[::-1])
+
+    def then(self, second: 'Tot', shift: int = 0) -> 'Tot':
+        def f(n: int, b: int) -> List[float]:
+            h1 = self.heights(n, b)
+            h2 = second.heights(n, b)
+            result = list(h1)
+            for k in range(len(h2)):
+                i = len(h1) + k + shift
+                while len(result) <= i:
+                    result.append(0)
+                result[i] += h2[k]
+            return result
+        return Tot(f)
+
+    def overlap(self, second: 'Tot', shift: int = 0):
+        def f(n: int, b: int) -> List[int]:
+            h1 = self.heights(n, b)
+            h2 = second.heights(n, b)
+            result = list(h1)
+            for k in range(len(h2)):
+                i = k + shift
+                while len(result) <= i:
+                    result.append(0)
+                result[i] += h2[k]
+            return result
+        return Tot(f)
+
+
+def fold_down(*,
+              scale: float = 1,
+              skip_start: int = 0,
+              skip_end: int = 0,
+              width: SimpleFormula = SimpleFormula(n=1),
+              reps: int = 1,
+              gap: int = 0) -> Tot:
+    def f(n: int, b: int) -> List[float]:
+        result = []
+        k = width.value(n, b)
+        for _ in range(skip_start):
+            k >>= 1
+        while k > 2**skip_end:
+            for _ in range(reps):
+                result.append(k * scale)
+            for _ in range(gap):
+                result.append(0)
+            k >>= 1
+        return result
+    return Tot(f)
+
+
+def hold(*, duration: Union[int, float, SimpleFormula], height: Union[int, float, SimpleFormula] = 1) -> Tot:
+    if isinstance(duration, (int, float)):
+        duration = SimpleFormula(constant=duration)
+    if isinstance(height, (int, float)):
+        height = SimpleFormula(constant=height)
+    return Tot(lambda n, b: [height.value(n, b)] * int(math.ceil(duration.value(n, b))))
+
+
+DEFAULT_N = 128
+DEFAULT_B = 10
+
+
+@dataclasses.dataclass
+class Adder:
+    author: str
+    year: int
+    citation: Optional[str]
+    type: str
+    in_place: bool
+    toffolis: SimpleFormula
+    reaction_depth: SimpleFormula
+    workspace: SimpleFormula
+    toffoli_usage: Optional[Tot] = None
+    dominated_in_phase_diagram: bool = False
+
+    def toffoli_usage_or_def(self, n: int, b: int) -> Tot:
+        if self.toffoli_usage is None:
+            t = self.reaction_depth.value(n, b)
+            v = self.toffolis.value(n, b)
+            return hold(duration=t, height=v / t)
+        return self.toffoli_usage
+
+    def is_b_sensitive(self):
+        return (
+            self.reaction_depth.is_b_sensitive() or
+            self.toffolis.is_b_sensitive() or
+            self.workspace.is_b_sensitive()
+        )
+
+    def vol(self,
+            *,
+            n: int,
+            factory_count: int,
+            factory_period: float = 165,
+            factory_area: float = 12 * 6,
+            reaction_time: float = 10) -> float:
+        if self.is_b_sensitive():
+            bs = range(2, n + 1)
+            if len(bs) > 50:
+                bs = list(range(2, 50))
+                while bs[-1] < n / 2:
+                    bs.append(int(bs[-1] * 1.2))
+        else:
+            bs = [DEFAULT_B]
+        return min(self.vol_b(
+            n=n,
+            b=b,
+            factory_count=factory_count,
+            factory_period=factory_period,
+            factory_area=factory_area,
+            reaction_time=reaction_time)
+            for b in bs
+        )
+
+    def vol_b(self,
+            *,
+            n: int,
+            b: int,
+            factory_count: float,
+            factory_period: float = 165,
+            factory_area: float = 12 * 6,
+            reaction_time: float = 10) -> float:
+        tof = self.toffolis.value(n, b)
+        dep = self.reaction_depth.value(n, b)
+        space = self.workspace.value(n, b)
+        average_supply, average_time, max_production_rate = self.toffoli_usage_or_def(n, b).simulate_supply(
+            n, b, max_production_rate=factory_count / factory_period * reaction_time)
+        space += average_supply
+        if self.in_place:
+            space += 2*n
+        else:
+            space += 3*n
+        time = average_time * reaction_time
+        result = factory_area * factory_period * tof + space * time
+        result /= 1000 * 1000  # Microseconds to seconds.
+        return result
@@ -0,0 +1,262 @@
+"""Splits the phase diagram sweeps into tiles that independent worker processes can compute.
+
+Usage:
+    python sweep.py plan DIR [--max-n 1000000] [--g 1.2] [--tile-n 4] [--tile-f 16]    (DIR must not hold a plan)
+    python sweep.py work DIR [--stale-after 3600]    (run as many of these as you like, on any machine sharing DIR)
+    python sweep.py merge DIR [--out-dir ../gen]    (also writes the volumes to DIR/dataset, see dataset.py)
+
+A tile is one adder evaluated over a rectangle of (factory count, register size) cells. Workers claim tiles by
+exclusively creating a claim file, keep the claim fresh while working, and publish results by atomically renaming
+a finished file into place. A worker that crashes leaves a claim that goes stale and is then picked up by another
+worker. Computing a tile twice is harmless, because both copies hold the same values.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import argparse
+import io
+import json
+import os
+import pathlib
+import socket
+import time
+
+import numpy as np
+
+from dataset import VolumeDataset
+from generate_figures import Adder, make_adders, phase_diagram_grid, phase_diagram_sweeps, plot_phase_diagram_helper
+
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def _sweeps() -> List[Tuple[List[Adder], str, str, float]]:
+    return phase_diagram_sweeps(make_adders())
+
+
+def plan(directory: pathlib.Path,
+         *,
+         max_n: int = 20000,
+         g: float = 1.5,
+         tile_n: int = 4,
+         tile_f: int = 16) -> Dict[str, Any]:
+    if (directory / MANIFEST_NAME).exists() or any((directory / 'results').glob('*.npz')):
+        # Tile ids are grid indices, so results from another plan would be silently merged at the wrong sizes.
+        raise ValueError(f"{directory} already contains a planned sweep. Plan into an empty directory.")
+    register_sizes, factory_counts = phase_diagram_grid(max_n=max_n, g=g)
+    sweeps = []
+    tiles = []
+    for s, (adder_set, title, file_name, d) in enumerate(_sweeps()):
+        sweeps.append({
+            'title': title,
+            'file_name': file_name,
+            'd': d,
+            'adders': [adder.label for adder in adder_set],
+        })
+        for a in range(len(adder_set)):
+            for i in range(0, len(register_sizes), tile_n):
+                for j in range(0, len(factory_counts), tile_f):
+                    tiles.append({
+                        'id': f'{s}-{a}-{i}-{j}',
+                        'sweep': s,
+                        'adder': a,
+                        'n_range': [i, min(i + tile_n, len(register_sizes))],
+                        'f_range': [j, min(j + tile_f, len(factory_counts))],
+                    })
+    manifest = {
+        'register_sizes': register_sizes,
+        'factory_counts': factory_counts,
+        'sweeps': sweeps,
+        'tiles': tiles,
+    }
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / 'claims').mkdir(exist_ok=True)
+    (directory / 'results').mkdir(exist_ok=True)
+    _write_atomic(directory / MANIFEST_NAME, json.dumps(manifest, indent=1).encode())
+    return manifest
+
+
+def load_manifest(directory: pathlib.Path) -> Dict[str, Any]:
+    with open(directory / MANIFEST_NAME) as f:
+        return json.load(f)
+
+
+def _matching_sweeps(manifest: Dict[str, Any]) -> List[Tuple[List[Adder], str, str, float]]:
+    sweeps = _sweeps()
+    for (adder_set, _, _, d), planned in zip(sweeps, manifest['sweeps']):
+        if [adder.label for adder in adder_set] != planned['adders'] or d != planned['d']:
+            raise ValueError(f"The adders defined in generate_figures.py no longer match the manifest's "
+                             f"sweep {planned['file_name']!r}. Plan a new sweep.")
+    if len(sweeps) != len(manifest['sweeps']):
+        raise ValueError("The sweeps defined in generate_figures.py no longer match the manifest. Plan a new sweep.")
+    return sweeps
+
+
+def _write_atomic(path: pathlib.Path, contents: bytes):
+    tmp = path.parent / f'.{path.name}.{socket.gethostname()}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(contents)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _result_path(directory: pathlib.Path, tile_id: str) -> pathlib.Path:
+    return directory / 'results' / f'{tile_id}.npz'
+
+
+def _try_claim(directory: pathlib.Path, tile_id: str, stale_after: float) -> Optional[pathlib.Path]:
+    claim = directory / 'claims' / tile_id
+    owner = f'{socket.gethostname()} {os.getpid()}\n'.encode()
+    try:
+        fd = os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            age = time.time() - claim.stat().st_mtime
+        except FileNotFoundError:
+            return None
+        if age < stale_after:
+            return None
+        # The previous owner stopped refreshing its claim. Take it over.
+        _write_atomic(claim, owner)
+        return claim
+    with os.fdopen(fd, 'wb') as f:
+        f.write(owner)
+    return claim
+
+
+def compute_tile(adder: Adder,
+                 *,
+                 d: float,
+                 register_sizes: List[int],
+                 factory_counts: List[int],
+                 heartbeat: Optional[pathlib.Path] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the volumes, and best block sizes, of one adder over a (factory count, register size) rectangle."""
+    volumes = np.zeros(shape=(len(factory_counts), len(register_sizes)), dtype=np.float64)
+    best_b = np.zeros(shape=(len(factory_counts), len(register_sizes)), dtype=np.int32)
+    for i, n in enumerate(register_sizes):
+        for j, f in enumerate(factory_counts):
+            volumes[j, i], best_b[j, i] = adder.vol_and_b(n=n,
+                                                          factory_count=f,
+                                                          factory_area=12 * 6 * d**2,
+                                                          factory_period=165 * d)
+        if heartbeat is not None:
+            os.utime(heartbeat)
+    return volumes, best_b
+
+
+def work(directory: pathlib.Path, *, stale_after: float = 3600) -> int:
+    """Computes unclaimed tiles until none are left. Returns the number of tiles this worker computed."""
+    manifest = load_manifest(directory)
+    sweeps = _matching_sweeps(manifest)
+    register_sizes = manifest['register_sizes']
+    factory_counts = manifest['factory_counts']
+    done = 0
+    for tile in manifest['tiles']:
+        tile_id = tile['id']
+        if _result_path(directory, tile_id).exists():
+            continue
+        claim = _try_claim(directory, tile_id, stale_after)
+        if claim is None:
+            continue
+        adder_set, _, _, d = sweeps[tile['sweep']]
+        i0, i1 = tile['n_range']
+        j0, j1 = tile['f_range']
+        volumes, best_b = compute_tile(adder_set[tile['adder']],
+                                       d=d,
+                                       register_sizes=register_sizes[i0:i1],
+                                       factory_counts=factory_counts[j0:j1],
+                                       heartbeat=claim)
+        contents = io.BytesIO()
+        np.savez(contents,
+                 volumes=volumes,
+                 best_b=best_b,
+                 register_sizes=register_sizes[i0:i1],
+                 factory_counts=factory_counts[j0:j1])
+        _write_atomic(_result_path(directory, tile_id), contents.getvalue())
+        done += 1
+        print(f"Computed tile {tile_id}")
+    return done
+
+
+def merge_volumes(directory: pathlib.Path, manifest: Dict[str, Any], sweep: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Assembles the (adder, factory count, register size) volumes and best block sizes of one sweep."""
+    shape = (len(manifest['sweeps'][sweep]['adders']),
+             len(manifest['factory_counts']),
+             len(manifest['register_sizes']))
+    volumes = np.full(shape=shape, fill_value=np.nan, dtype=np.float64)
+    best_b = np.full(shape=shape, fill_value=-1, dtype=np.int32)
+    missing = []
+    for tile in manifest['tiles']:
+        if tile['sweep'] != sweep:
+            continue
+        path = _result_path(directory, tile['id'])
+        if not path.exists():
+            missing.append(tile['id'])
+            continue
+        i0, i1 = tile['n_range']
+        j0, j1 = tile['f_range']
+        with np.load(path) as tile_data:
+            if (list(tile_data['register_sizes']) != manifest['register_sizes'][i0:i1]
+                    or list(tile_data['factory_counts']) != manifest['factory_counts'][j0:j1]):
+                raise ValueError(f"Tile {tile['id']!r} was computed for a different grid than the manifest's.")
+            volumes[tile['adder'], j0:j1, i0:i1] = tile_data['volumes']
+            best_b[tile['adder'], j0:j1, i0:i1] = tile_data['best_b']
+    if missing:
+        raise ValueError(f"{len(missing)} tiles of sweep {manifest['sweeps'][sweep]['file_name']!r} "
+                         f"are not finished yet (e.g. {missing[0]!r}).")
+    return volumes, best_b
+
+
+def merge(directory: pathlib.Path, out_dir: pathlib.Path):
+    manifest = load_manifest(directory)
+    sweeps = _matching_sweeps(manifest)
+    dataset = VolumeDataset.create(directory / 'dataset',
+                                   adders=make_adders(),
+                                   register_sizes=manifest['register_sizes'],
+                                   factory_counts=manifest['factory_counts'],
+                                   distances=[d for _, _, _, d in sweeps])
+    for s, (adder_set, title, file_name, d) in enumerate(sweeps):
+        volumes, best_b = merge_volumes(directory, manifest, s)
+        k = dataset.metadata['distances'].index(d)
+        for a, adder in enumerate(adder_set):
+            dataset.volumes[dataset.metadata['adders'].index(adder.label), :, :, k] = volumes[a].T
+            dataset.best_b[dataset.metadata['adders'].index(adder.label), :, :, k] = best_b[a].T
+        plot_phase_diagram_helper(adder_set,
+                                  title,
+                                  filepath=out_dir / file_name,
+                                  d=d,
+                                  factory_counts=manifest['factory_counts'],
+                                  register_sizes=manifest['register_sizes'],
+                                  data=np.argmin(volumes, axis=0).astype(np.int32))
+    dataset.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    plan_parser = commands.add_parser('plan')
+    plan_parser.add_argument('directory', type=pathlib.Path)
+    plan_parser.add_argument('--max-n', type=int, default=20000)
+    plan_parser.add_argument('--g', type=float, default=1.5)
+    plan_parser.add_argument('--tile-n', type=int, default=4)
+    plan_parser.add_argument('--tile-f', type=int, default=16)
+    work_parser = commands.add_parser('work')
+    work_parser.add_argument('directory', type=pathlib.Path)
+    work_parser.add_argument('--stale-after', type=float, default=3600)
+    merge_parser = commands.add_parser('merge')
+    merge_parser.add_argument('directory', type=pathlib.Path)
+    merge_parser.add_argument('--out-dir', type=pathlib.Path, default=pathlib.Path(__file__).parent.parent / 'gen')
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        manifest = plan(args.directory, max_n=args.max_n, g=args.g, tile_n=args.tile_n, tile_f=args.tile_f)
+        print(f"Planned {len(manifest['tiles'])} tiles in {args.directory}")
+    elif args.command == 'work':
+        work(args.directory, stale_after=args.stale_after)
+    elif args.command == 'merge':
+        merge(args.directory, args.out_dir)
+
+
+if __name__ == '__main__':
+    main()